@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+
+# modules a flatten job must not load before it writes its output
+FORBIDDEN_MODULES = ['matplotlib', 'pandas', 'hist', 'scipy']
+
+CHECK_IMPORTS = f'''
+import sys
+import NanoAODTnP.Analysis.NanoAOD
+print(' '.join(each for each in {FORBIDDEN_MODULES!r} if each in sys.modules))
+'''
+
+
+def get_env(module_dir):
+    env = dict(os.environ)
+    if module_dir is not None:
+        env['PYTHONPATH'] = os.pathsep.join(
+            [str(module_dir)] + env.get('PYTHONPATH', '').split(os.pathsep))
+    return env
+
+def measure_startup(script_path: Path, env: dict, repeat: int) -> np.ndarray:
+    """
+    wall time of `script --help`, i.e. interpreter startup, imports and
+    argument parsing, the fixed cost of every condor job
+    """
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(script_path), '--help'], env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        elapsed.append(time.perf_counter() - start)
+    return np.array(elapsed)
+
+def find_loaded_modules(env: dict) -> list[str]:
+    result = subprocess.run([sys.executable, '-c', CHECK_IMPORTS], env=env,
+                            check=True, capture_output=True, text=True)
+    return result.stdout.split()
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-s', '--script-path', type=Path,
+                        default=Path(__file__).with_name('tnp-flatten-script.py'),
+                        help='flatten script to benchmark')
+    parser.add_argument('-m', '--module-dir', type=Path,
+                        help='directory containing NanoAODTnP, prepended to PYTHONPATH')
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help='number of runs, the first one warms the file cache')
+    parser.add_argument('-b', '--budget', type=float, default=0.8,
+                        help='maximum median startup time [s]')
+    args = parser.parse_args()
+
+    env = get_env(args.module_dir)
+    loaded = find_loaded_modules(env)
+    elapsed = measure_startup(args.script_path, env, args.repeat + 1)[1:]
+    median = np.median(elapsed)
+
+    print(f'startup: median {median:.3f} s, min {elapsed.min():.3f} s, '
+          f'max {elapsed.max():.3f} s over {len(elapsed)} runs (budget {args.budget:.3f} s)')
+    failed = False
+    if loaded:
+        print(f'FAIL: importing NanoAOD loads {", ".join(loaded)}')
+        failed = True
+    if median > args.budget:
+        print('FAIL: median startup time exceeds the budget')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+from pathlib import Path
+
+sys.path.append("/users/hep/eigen1907/Workspace/Workspace-RPC/modules")
+from NanoAODTnP.Analysis.BlacklistCheck import check_read_time_blacklist
+from NanoAODTnP.Analysis.BlacklistCheck import get_off_axis_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='check that blacklists applied when reading the counts '
+                    'equal the ones applied when flattening, for every '
+                    'variant of the flatten campaign',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-c', '--cert-path', required=True, type=Path,
+                        help='Golden JSON file')
+    parser.add_argument('-g', '--geom-path', required=True, type=Path,
+                        help='csv file containing RPC roll information')
+    parser.add_argument('-r', '--run-path', required=True, type=Path,
+                        help='csv file containing the run axis')
+    parser.add_argument('--roll-blacklist-path', type=Path,
+                        help='roll blacklist json')
+    parser.add_argument('--run-blacklist-path', type=Path,
+                        help='run blacklist json')
+    parser.add_argument('-i', '--input-path', type=Path,
+                        help='NanoAOD file, a synthetic one if not given')
+    parser.add_argument('-n', '--n-event', default=200_000, type=int,
+                        help='number of synthetic events')
+    parser.add_argument('-s', '--seed', default=0, type=int,
+                        help='random seed of the synthetic events')
+    args = parser.parse_args()
+
+    off_axis_runs = get_off_axis_runs(args.run_blacklist_path, args.run_path)
+    if len(off_axis_runs) > 0:
+        print(f'blacklisted runs off the run axis, only masked when '
+              f'flattening: {off_axis_runs}')
+
+    mismatch = check_read_time_blacklist(
+        cert_path=args.cert_path,
+        geom_path=args.geom_path,
+        run_path=args.run_path,
+        roll_blacklist_path=args.roll_blacklist_path,
+        run_blacklist_path=args.run_blacklist_path,
+        input_path=args.input_path,
+        n_event=args.n_event,
+        seed=args.seed,
+    )
+    for variant, keys in mismatch.items():
+        print(f'{variant}: {"FAIL " + ", ".join(keys) if keys else "ok"}')
+    sys.exit(1 if any(mismatch.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #!/bin/bash
-TYPES=(without_blacklist with_blacklist_roll with_blacklist_roll_run with_blacklist_roll_run_RE4)
-#TYPES=(with_blacklist_roll_run_RE4)
+# blacklists and RE4 are applied at read time (RollRunCount.apply_blacklist)
+TYPES=(without_blacklist)
+#TYPES=(without_blacklist with_blacklist_roll with_blacklist_roll_run with_blacklist_roll_run_RE4)
 for TYPE in ${TYPES[@]}
 do
     WOKING_DIR=$(pwd)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+from glob import glob
+from pathlib import Path
+
+sys.path.append("/users/hep/eigen1907/Workspace/Workspace-RPC/modules")
+from NanoAODTnP.Analysis.NanoAOD import flatten_nanoaod_files
+
+def find_input_paths(patterns: list[str]) -> list[Path]:
+    """
+    directories are searched recursively for root files, anything else is
+    expanded as a glob pattern
+    """
+    input_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            input_paths += sorted(Path(pattern).rglob('*.root'))
+        else:
+            input_paths += [Path(each) for each in sorted(glob(pattern))]
+    return input_paths
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-i', '--input-path', required=True, nargs='+',
+                        type=str,
+                        help='input NanoAOD files, directories or glob patterns')
+    parser.add_argument('-c', '--cert-path', required=True, type=Path,
+                        help='Golden JSON file')
+    parser.add_argument('-g', '--geom-path', required=True, type=Path,
+                        help='csv file containing RPC roll information')
+    parser.add_argument('-r', '--run-path', required=True, type=Path,
+                        help='csv file contaning existing run list')
+    parser.add_argument('-o', '--output-path', default='output.root',
+                        type=Path, help='merged output file name')
+    parser.add_argument('-n', '--name', default='rpcTnP', type=str,
+                        help='branch prefix')
+    parser.add_argument('-j', '--max-workers', type=int,
+                        help='number of worker processes '
+                             '(default: number of cores)')
+    parser.add_argument('--roll-blacklist-path', type=str,
+                        help='blacklist roll file')
+    parser.add_argument('--run-blacklist-path', type=str,
+                        help='blacklist run file')
+    parser.add_argument('--exclude-RE4', type=bool,
+                        help='True: Exclude RE4, False(default): include RE4')
+    parser.add_argument('--step-size', type=str,
+                        help='read each input in chunks of this many entries '
+                             '(e.g. 100000) or bytes (e.g. "100 MB"); '
+                             'read the whole file at once if not given')
+    args = parser.parse_args()
+
+    input_paths = find_input_paths(args.input_path)
+    if len(input_paths) == 0:
+        parser.error(f'no input file found in {args.input_path}')
+
+    step_size = args.step_size
+    if step_size is not None and step_size.isdigit():
+        step_size = int(step_size)
+
+    flatten_nanoaod_files(
+        input_paths=input_paths,
+        cert_path=args.cert_path,
+        geom_path=args.geom_path,
+        run_path=args.run_path,
+        output_path=args.output_path,
+        name=args.name,
+        roll_blacklist_path=args.roll_blacklist_path,
+        run_blacklist_path=args.run_blacklist_path,
+        exclude_RE4=args.exclude_RE4,
+        step_size=step_size,
+        max_workers=args.max_workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -28,8 +28,16 @@ def main():
                         help='blacklist run file')
     parser.add_argument('--exclude-RE4', type=bool,
                         help='True: Exclude RE4, False(default): include RE4')
+    parser.add_argument('--step-size', type=str,
+                        help='read the input in chunks of this many entries '
+                             '(e.g. 100000) or bytes (e.g. "100 MB"); '
+                             'read the whole file at once if not given')
     args = parser.parse_args()
 
+    step_size = args.step_size
+    if step_size is not None and step_size.isdigit():
+        step_size = int(step_size)
+
     flatten_nanoaod(
         input_path=args.input_path,
         cert_path=args.cert_path,
@@ -40,6 +48,7 @@ def main():
         roll_blacklist_path=args.roll_blacklist_path,
         run_blacklist_path=args.run_blacklist_path,
         exclude_RE4=args.exclude_RE4,
+        step_size=step_size,
     )
 
 
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+from pathlib import Path
+
+sys.path.append("/users/hep/eigen1907/Workspace/Workspace-RPC/modules")
+from NanoAODTnP.Analysis.SyntheticNanoAOD import make_synthetic_nanoaod
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='write a synthetic rpcTnP NanoAOD file for benchmarks',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-o', '--output-path', default='synthetic.root',
+                        type=Path, help='output file name')
+    parser.add_argument('-g', '--geom-path', required=True, type=Path,
+                        help='csv file containing RPC roll information')
+    parser.add_argument('-c', '--cert-path', required=True, type=Path,
+                        help='Golden JSON file, runs and lumi sections are drawn from it')
+    parser.add_argument('-n', '--n-event', default=100_000, type=int,
+                        help='number of events')
+    parser.add_argument('--first-run', type=int, help='first run')
+    parser.add_argument('--last-run', type=int, help='last run')
+    parser.add_argument('-s', '--seed', default=0, type=int, help='random seed')
+    parser.add_argument('--chunk-size', default=100_000, type=int,
+                        help='number of events generated and written at once')
+    parser.add_argument('--name', default='rpcTnP', type=str,
+                        help='branch prefix')
+    args = parser.parse_args()
+
+    make_synthetic_nanoaod(
+        output_path=args.output_path,
+        geom_path=args.geom_path,
+        cert_path=args.cert_path,
+        n_event=args.n_event,
+        first_run=args.first_run,
+        last_run=args.last_run,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        name=args.name,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+from typing import Optional
+import numpy as np
+import numpy.typing as npt
+
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable
+
+IRPC_ROLLS = ['RE+4_R1_CH15_A', 'RE+4_R1_CH16_A',
+              'RE+3_R1_CH15_A', 'RE+3_R1_CH16_A']
+
+
+class Blacklist:
+    """
+    sorted array of blacklisted keys (roll indices, run numbers or roll names)
+    """
+
+    def __init__(self, keys: npt.ArrayLike = ()):
+        self.keys = np.unique(np.asarray(keys))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __or__(self, other: 'Blacklist') -> 'Blacklist':
+        if len(self) == 0:
+            return other
+        if len(other) == 0:
+            return self
+        return Blacklist(np.concatenate([self.keys, other.keys]))
+
+    @classmethod
+    def from_json(cls, path: Optional[str]):
+        if path is None:
+            return cls()
+        with open(path) as stream:
+            return cls(json.load(stream))
+
+    def get_mask(self, values: npt.ArrayLike) -> npt.NDArray[np.bool_]:
+        """
+        True for values that are NOT blacklisted
+        """
+        values = np.asarray(values)
+        if len(self) == 0:
+            return np.ones(values.shape, dtype=bool)
+        pos = np.searchsorted(self.keys, values)
+        pos = np.minimum(pos, len(self) - 1)
+        return self.keys[pos] != values
+
+
+def load_roll_blacklist(path: Optional[str],
+                        roll_table: RollTable,
+) -> Blacklist:
+    """
+    roll blacklist json (list of roll names) compiled into roll indices;
+    names unknown to the table are dropped
+    """
+    roll_name = Blacklist.from_json(path).keys
+    roll_index = roll_table.get_roll_index_by_name(roll_name)
+    return Blacklist(roll_index[roll_index >= 0])
+
+
+def load_run_blacklist(path: Optional[str]) -> Blacklist:
+    blacklist = Blacklist.from_json(path)
+    return Blacklist(blacklist.keys.astype(np.int64))
+
+
+def get_irpc_blacklist(roll_table: RollTable) -> Blacklist:
+    roll_index = roll_table.get_roll_index_by_name(IRPC_ROLLS)
+    return Blacklist(roll_index[roll_index >= 0])
+
+
+def get_re4_blacklist(roll_table: RollTable) -> Blacklist:
+    return Blacklist(np.flatnonzero((roll_table.region != 0) &
+                                    (roll_table.station == 4)))
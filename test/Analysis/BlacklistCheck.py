@@ -0,0 +1,87 @@
+import tempfile
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+from NanoAODTnP.Analysis.NanoAOD import flatten_nanoaod
+from NanoAODTnP.Analysis.RollRunCount import RollRunCount
+from NanoAODTnP.Analysis.Blacklist import load_run_blacklist
+from NanoAODTnP.Analysis.SyntheticNanoAOD import make_synthetic_nanoaod
+
+COUNT_KEYS = ['total_by_roll', 'passed_by_roll', 'total', 'passed']
+
+
+def get_blacklist_variants(roll_blacklist_path: Optional[Path],
+                           run_blacklist_path: Optional[Path],
+) -> dict[str, dict]:
+    """
+    blacklist arguments of the variants of the flatten campaign
+    """
+    return {
+        'with_blacklist_roll': dict(
+            roll_blacklist_path=roll_blacklist_path),
+        'with_blacklist_roll_run': dict(
+            roll_blacklist_path=roll_blacklist_path,
+            run_blacklist_path=run_blacklist_path),
+        'with_blacklist_roll_run_RE4': dict(
+            roll_blacklist_path=roll_blacklist_path,
+            run_blacklist_path=run_blacklist_path,
+            exclude_RE4=True),
+    }
+
+
+def get_off_axis_runs(run_blacklist_path: Optional[Path],
+                      run_path: Path,
+) -> list[int]:
+    """
+    blacklisted runs that are not on the run axis and thus cannot be masked
+    at read time
+    """
+    run = np.genfromtxt(run_path, delimiter=',', names=True, dtype=np.int64)
+    blacklist = load_run_blacklist(run_blacklist_path).keys
+    return np.setdiff1d(blacklist, np.atleast_1d(run['run'])).tolist()
+
+
+def check_read_time_blacklist(cert_path: Path,
+                              geom_path: Path,
+                              run_path: Path,
+                              roll_blacklist_path: Optional[Path] = None,
+                              run_blacklist_path: Optional[Path] = None,
+                              input_path: Optional[Path] = None,
+                              n_event: int = 200_000,
+                              seed: int = 0,
+                              name: str = 'rpcTnP',
+) -> dict[str, list[str]]:
+    """
+    flatten once without blacklists, apply each campaign variant at read
+    time and compare it with the same variant applied when flattening.
+    input_path defaults to a synthetic NanoAOD file of n_event events drawn
+    from cert_path. returns the count keys that differ, by variant.
+    """
+    variants = get_blacklist_variants(roll_blacklist_path, run_blacklist_path)
+    kwargs = dict(cert_path=cert_path, geom_path=geom_path, run_path=run_path,
+                  name=name)
+    mismatch = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        if input_path is None:
+            input_path = tmp_dir / 'synthetic.root'
+            make_synthetic_nanoaod(input_path, geom_path=geom_path,
+                                   cert_path=cert_path, n_event=n_event,
+                                   seed=seed, name=name)
+
+        agnostic_path = tmp_dir / 'without_blacklist.root'
+        flatten_nanoaod(input_path, output_path=agnostic_path, **kwargs)
+        count = RollRunCount.from_root(agnostic_path)
+        for variant, blacklist in variants.items():
+            flatten_time_path = tmp_dir / f'{variant}.root'
+            flatten_nanoaod(input_path, output_path=flatten_time_path,
+                            **kwargs, **blacklist)
+            read_time = count.apply_blacklist(**blacklist)
+            flatten_time = RollRunCount.from_root(flatten_time_path)
+            mismatch[variant] = [
+                key for key in COUNT_KEYS
+                if not np.array_equal(getattr(read_time, key),
+                                      getattr(flatten_time, key))
+            ]
+    return mismatch
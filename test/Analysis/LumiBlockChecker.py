@@ -1,10 +1,15 @@
 import json
+from pathlib import Path
+from typing import Optional
 import numpy as np
 import numpy.typing as npt
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import singledispatchmethod
 
+from NanoAODTnP.Cache import get_cache_path, write_cache
 
+# bump when the layout of the keys cached by LumiBlockChecker.from_json changes
+CERT_CACHE_VERSION = 1
 
 
 @dataclass
@@ -13,6 +18,25 @@ class LumiBlockChecker:
     https://twiki.cern.ch/twiki/bin/view/CMSPublic/SWGuideGoodLumiSectionsJSONFile
     """
     cert: dict[np.uint32, npt.NDArray[np.uint32]]
+    # (run << 32 | lumi) boundaries of all runs, sorted by run then lumi
+    keys: Optional[npt.NDArray[np.int64]] = field(default=None, repr=False,
+                                                 compare=False)
+
+    def __post_init__(self):
+        if self.keys is None:
+            self.keys = self._build_keys(self.cert)
+
+    @staticmethod
+    def _build_keys(cert: dict[np.uint32, npt.NDArray[np.uint32]]
+    ) -> npt.NDArray[np.int64]:
+        """
+        """
+        if len(cert) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            (np.int64(run) << 32) | cert[run].astype(np.int64)
+            for run in sorted(cert)
+        ])
 
     @staticmethod
     def _transform_lumi_ranges(lumi: list[tuple[int, int]]
@@ -31,10 +55,104 @@ class LumiBlockChecker:
         return cls(flat_cert)
 
     @classmethod
-    def from_json(cls, path):
-        with open(path) as stream:
-            cert = json.load(stream)
-        return cls.from_dict(cert)
+    def from_keys(cls, keys: npt.NDArray[np.int64]):
+        """
+        inverse of _build_keys
+        """
+        run = (keys >> 32).astype(np.uint32)
+        lumi = (keys & 0xFFFFFFFF).astype(np.uint32)
+        unique_run, first = np.unique(run, return_index=True)
+        cert = dict(zip(unique_run, np.split(lumi, first[1:])))
+        # keep the (possibly memory-mapped) array instead of rebuilding it
+        return cls(cert, keys=keys)
+
+    @classmethod
+    def from_json(cls, path, cache_dir: Optional[Path] = None):
+        """
+        the compiled keys are cached as a .npy file named after the hash of
+        the json content, under cert/v{CERT_CACHE_VERSION}, so later calls
+        skip parsing and memory-map the cached array. cache_dir defaults to
+        get_cache_dir(); nothing is cached if it is not writable.
+        """
+        with open(path, 'rb') as stream:
+            content = stream.read()
+        cache_path = get_cache_path('cert', content, CERT_CACHE_VERSION, '.npy',
+                                    cache_dir)
+        try:
+            return cls.from_keys(np.load(cache_path, mmap_mode='r'))
+        except (OSError, ValueError):
+            pass
+
+        checker = cls.from_dict(json.loads(content))
+        write_cache(cache_path, lambda stream: np.save(stream, checker.keys))
+        return checker
+
+    def to_dict(self) -> dict[str, list[list[int]]]:
+        """
+        inverse of from_dict, in the golden json format
+        """
+        cert = {}
+        for run in sorted(self.cert):
+            ranges = self.cert[run].astype(np.int64).reshape(-1, 2)
+            # (first, last] back to [first, last]
+            ranges[:, 0] += 1
+            cert[str(run)] = ranges.tolist()
+        return cert
+
+    def to_json(self, path):
+        with open(path, 'w') as stream:
+            json.dump(self.to_dict(), stream)
+
+    def _combine(self, other: 'LumiBlockChecker', op) -> 'LumiBlockChecker':
+        """
+        apply a boolean op to the membership of self and other on every
+        segment between their boundaries and merge the selected segments
+        """
+        points = np.union1d(self.keys, other.keys)
+        # segment i is (points[i], points[i + 1]] and has no boundary inside
+        in_self = (np.searchsorted(self.keys, points[1:]) & 0x1).astype(bool)
+        in_other = (np.searchsorted(other.keys, points[1:]) & 0x1).astype(bool)
+        selected = np.concatenate([[False], op(in_self, in_other), [False]])
+        change = np.flatnonzero(selected[1:] != selected[:-1])
+        return self.from_keys(points[change].astype(np.int64))
+
+    def union(self, other: 'LumiBlockChecker') -> 'LumiBlockChecker':
+        return self._combine(other, np.logical_or)
+
+    def intersection(self, other: 'LumiBlockChecker') -> 'LumiBlockChecker':
+        return self._combine(other, np.logical_and)
+
+    def difference(self, other: 'LumiBlockChecker') -> 'LumiBlockChecker':
+        return self._combine(other, lambda a, b: a & ~b)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def select_runs(self, run_mask) -> 'LumiBlockChecker':
+        """
+        keep the runs where run_mask(run array) is True; both boundaries of a
+        range share the same run, so ranges are kept or dropped as a whole
+        """
+        return self.from_keys(self.keys[run_mask(self.keys >> 32)])
+
+    def restrict_runs(self,
+                      first_run: Optional[int] = None,
+                      last_run: Optional[int] = None,
+    ) -> 'LumiBlockChecker':
+        """
+        keep the runs in [first_run, last_run]
+        """
+        first_run = 0 if first_run is None else first_run
+        last_run = np.iinfo(np.uint32).max if last_run is None else last_run
+        return self.select_runs(lambda run: (run >= first_run) & (run <= last_run))
+
+    def exclude_runs(self, runs: npt.ArrayLike) -> 'LumiBlockChecker':
+        """
+        e.g. golden minus the run blacklist
+        """
+        runs = np.asarray(runs, dtype=np.int64)
+        return self.select_runs(lambda run: ~np.isin(run, runs))
 
     @staticmethod
     def _get_lumi_mask(lumi_arr: npt.NDArray[np.uint32],
@@ -76,8 +194,8 @@ class LumiBlockChecker:
     ) -> npt.NDArray[np.bool_]:
         """
         """
-        mask = np.full_like(lumi, fill_value=False, dtype=bool)
-        for each in np.unique(run):
-            run_mask = run == each
-            mask[run_mask] = self.get_lumi_mask(each, lumi[run_mask])
-        return mask
\ No newline at end of file
+        # a single search over all runs; runs missing in the cert fall
+        # between the blocks of other runs and get an even index
+        keys = (run.astype(np.int64) << 32) | lumi.astype(np.int64)
+        indices = np.searchsorted(self.keys, keys)
+        return (indices & 0x1).astype(bool)
@@ -0,0 +1,160 @@
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from NanoAODTnP.Analysis.LumiBlockChecker import LumiBlockChecker
+
+PathList = Union[str, Path, list[Union[str, Path]]]
+
+
+def _as_list(path: PathList) -> list[Union[str, Path]]:
+    return [path] if isinstance(path, (str, Path)) else list(path)
+
+def _read_brilcalc(path: PathList, names: list[str]) -> pd.DataFrame:
+    """
+    brilcalc csv output, the header and the summary are '#' comments
+    """
+    paths = _as_list(path)
+    return pd.concat([pd.read_csv(each, comment='#', header=None, names=names)
+                      for each in paths], ignore_index=True)
+
+
+@dataclass
+class LumiIndex:
+    """
+    recorded luminosity [/fb] by run, optionally by lumi section, sorted by
+    run for searchsorted lookups
+    """
+    run: npt.NDArray[np.int64]
+    recorded: npt.NDArray[np.float64]
+    # number of lumi sections of a run, 0 if unknown
+    nls: npt.NDArray[np.int64]
+    time: npt.NDArray[np.datetime64]
+    # per lumi section (run << 32 | ls) keys and recorded luminosity
+    ls_key: Optional[npt.NDArray[np.int64]] = None
+    ls_recorded: Optional[npt.NDArray[np.float64]] = None
+
+    def __post_init__(self):
+        order = np.argsort(self.run, kind='stable')
+        self.run = np.asarray(self.run, dtype=np.int64)[order]
+        self.recorded = np.asarray(self.recorded, dtype=np.float64)[order]
+        self.nls = np.asarray(self.nls, dtype=np.int64)[order]
+        self.time = np.asarray(self.time, dtype='datetime64[s]')[order]
+
+    @classmethod
+    def from_brilcalc(cls, path: PathList):
+        """
+        brilcalc lumi --byrun -u /fb ... -o Lumi202xByRun.csv
+        """
+        data = _read_brilcalc(path, ['run_fill', 'time', 'nls', 'ncms',
+                                     'delivered', 'recorded'])
+        time = pd.to_datetime(data['time'], format='%m/%d/%y %H:%M:%S')
+        return cls(
+            run=data['run_fill'].str.split(':').str[0].astype(np.int64).to_numpy(),
+            recorded=data['recorded'].to_numpy(),
+            nls=data['nls'].to_numpy(),
+            time=time.to_numpy(),
+        )
+
+    @classmethod
+    def from_run_info(cls, path: PathList):
+        """
+        data/run_info/run_info.csv, which has no number of lumi sections
+        """
+        paths = _as_list(path)
+        data = pd.concat([pd.read_csv(each, index_col=False) for each in paths],
+                         ignore_index=True)
+        return cls(
+            run=data['run_number'].to_numpy(),
+            recorded=data['recorded_lumi'].to_numpy(),
+            nls=np.zeros(len(data), dtype=np.int64),
+            time=pd.to_datetime(data['start_time']).to_numpy(),
+        )
+
+    def with_lumi_sections(self, path: PathList) -> 'LumiIndex':
+        """
+        add brilcalc lumi --byls output (recorded in /ub), used instead of
+        the per-run approximation when certified ranges are joined
+        """
+        data = _read_brilcalc(path, ['run_fill', 'ls', 'time', 'beam_status',
+                                     'energy', 'delivered', 'recorded',
+                                     'avgpu', 'source'])
+        run = data['run_fill'].str.split(':').str[0].astype(np.int64).to_numpy()
+        ls = data['ls'].astype(str).str.split(':').str[0].astype(np.int64).to_numpy()
+        key = (run << 32) | ls
+        order = np.argsort(key)
+        self.ls_key = key[order]
+        # /ub to /fb
+        self.ls_recorded = data['recorded'].to_numpy(dtype=np.float64)[order] * 1e-9
+        return self
+
+    def _get_certified_fraction(self, checker: LumiBlockChecker
+    ) -> npt.NDArray[np.float64]:
+        """
+        certified lumi sections over all lumi sections of each run; runs
+        without nls count as fully certified if they are in the cert
+        """
+        n_certified = np.zeros(len(self.run), dtype=np.int64)
+        if len(self.run) == 0:
+            return n_certified.astype(np.float64)
+        start, end = checker.keys[0::2], checker.keys[1::2]
+        pos = np.searchsorted(self.run, start >> 32)
+        pos = np.minimum(pos, len(self.run) - 1)
+        found = self.run[pos] == (start >> 32)
+        np.add.at(n_certified, pos[found], (end - start)[found])
+
+        in_cert = np.isin(self.run, np.asarray(list(checker.cert), dtype=np.int64))
+        fraction = np.divide(n_certified, self.nls,
+                             out=in_cert.astype(np.float64),
+                             where=self.nls > 0)
+        return np.minimum(fraction, 1.0)
+
+    def get_run_mask(self,
+                     runs: Optional[npt.ArrayLike] = None,
+                     first_run: Optional[int] = None,
+                     last_run: Optional[int] = None,
+                     start_time: Optional[datetime] = None,
+                     end_time: Optional[datetime] = None,
+    ) -> npt.NDArray[np.bool_]:
+        mask = np.ones(len(self.run), dtype=bool)
+        if runs is not None:
+            mask &= np.isin(self.run, np.asarray(runs, dtype=np.int64))
+        if first_run is not None:
+            mask &= self.run >= first_run
+        if last_run is not None:
+            mask &= self.run <= last_run
+        if start_time is not None:
+            mask &= self.time >= np.datetime64(start_time, 's')
+        if end_time is not None:
+            mask &= self.time <= np.datetime64(end_time, 's')
+        return mask
+
+    def get_recorded_lumi(self,
+                          checker: Optional[LumiBlockChecker] = None,
+                          runs: Optional[npt.ArrayLike] = None,
+                          first_run: Optional[int] = None,
+                          last_run: Optional[int] = None,
+                          start_time: Optional[datetime] = None,
+                          end_time: Optional[datetime] = None,
+    ) -> float:
+        """
+        integrated recorded luminosity [/fb] of the selected runs, restricted
+        to the certified lumi sections of checker if given
+        """
+        run_mask = self.get_run_mask(runs, first_run, last_run,
+                                     start_time, end_time)
+        if checker is None:
+            return float(np.nansum(self.recorded[run_mask]))
+
+        if self.ls_key is not None and self.ls_recorded is not None:
+            run = self.ls_key >> 32
+            mask = checker.get_lumi_mask(run, self.ls_key & 0xFFFFFFFF)
+            mask &= np.isin(run, self.run[run_mask])
+            return float(np.sum(self.ls_recorded[mask]))
+
+        fraction = self._get_certified_fraction(checker)
+        return float(np.nansum((self.recorded * fraction)[run_mask]))
@@ -1,42 +1,40 @@
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Union
 from pathlib import Path
+from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
 import numpy as np
 import awkward as ak
 import uproot
-import pandas as pd
-from hist.hist import Hist
-from hist.axis import StrCategory, IntCategory
-import json
 
-from NanoAODTnP.RPCGeometry.RPCGeomServ import get_roll_name
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable
 from NanoAODTnP.Analysis.LumiBlockChecker import LumiBlockChecker
+from NanoAODTnP.Analysis.RollRunCount import RollRunCounter
+from NanoAODTnP.Analysis.TreeSchema import HIT_SCHEMA, MUON_SCHEMA
+from NanoAODTnP.Analysis.TreeSchema import apply_schema, write_schema
+from NanoAODTnP.Analysis.Blacklist import Blacklist
+from NanoAODTnP.Analysis.Blacklist import load_roll_blacklist, load_run_blacklist
+from NanoAODTnP.Analysis.Blacklist import get_irpc_blacklist, get_re4_blacklist
+
+MUON_KEYS = ['tag_pt', 'tag_eta', 'tag_phi',
+             'probe_pt', 'probe_eta', 'probe_phi',
+             'probe_time', 'probe_dxdz', 'probe_dydz',
+             'dimuon_pt', 'dimuon_mass']
 
 def get_roll_blacklist_mask(roll_name: np.ndarray,
-                            roll_blacklist_path: str,
+                            roll_blacklist_path: Optional[str],
 ):
-    if roll_blacklist_path is None:
-        roll_blacklist = set()
-    with open(roll_blacklist_path) as stream:
-        roll_blacklist = set(json.load(stream))
-
-    roll_blacklist_mask = np.vectorize(lambda roll: roll not in roll_blacklist)(roll_name)
-    return roll_blacklist_mask
+    return Blacklist.from_json(roll_blacklist_path).get_mask(roll_name)
 
 def get_run_blacklist_mask(runs: np.ndarray,
-                           run_blacklist_path: str,      
+                           run_blacklist_path: Optional[str],
 ):
-    if run_blacklist_path is None:
-        run_blacklist = set()
-    with open(run_blacklist_path) as stream:
-        run_blacklist = set((json.load(stream)))
+    return load_run_blacklist(run_blacklist_path).get_mask(runs)
 
-    run_blacklist_mask = np.vectorize(lambda run: run not in run_blacklist)(runs)
-    return run_blacklist_mask
-
-def read_nanoaod_by_hit(path,
-                        cert_path: str,
-                        treepath: str = 'Events',
-                        name: str = 'rpcTnP',
+def _open_nanoaod(path,
+                  treepath: str = 'Events',
+                  name: str = 'rpcTnP',
 ):
     tree = uproot.open(f'{path}:{treepath}')
 
@@ -47,68 +45,190 @@ def read_nanoaod_by_hit(path,
     aliases['size'] = f'n{name}'
     expressions = list(aliases.keys()) + ['run', 'luminosityBlock', 'event']
     cut = f'(n{name} > 0)'
+    return tree, dict(expressions=expressions, aliases=aliases, cut=cut)
 
-    hit_tree: dict[str, np.ndarray] = tree.arrays(
-        expressions = expressions,
-        aliases = aliases,
-        cut = cut,
-        library = 'np'
-    )
+def _split_nanoaod(tree: dict[str, np.ndarray],
+                   lumi_block_checker: LumiBlockChecker,
+) -> Optional[tuple[dict[str, np.ndarray], dict[str, np.ndarray]]]:
+    """
+    derive the hit-level and the muon-level trees from the same arrays
+    """
+    run = tree.pop('run')
+    lumi_block = tree.pop('luminosityBlock')
+    size = tree.pop('size')
+    event = tree.pop('event')
+
+    mask = lumi_block_checker.get_lumi_mask(run, lumi_block)
+    if not np.any(mask):
+        return None
+    tree = {key: value[mask] for key, value in tree.items()}
+
+    size = size[mask]
+    hit_tree = {key: np.concatenate(value) for key, value in tree.items()}
+    hit_tree['run'] = np.repeat(run[mask], size)
+    hit_tree['event'] = np.repeat(event[mask], size)
 
-    run = hit_tree.pop('run')
-    lumi_block = hit_tree.pop('luminosityBlock')
-    size = hit_tree.pop('size')
-    event = hit_tree.pop('event')
+    # muon variables are repeated for every hit of an event, so the first
+    # hit of each event sits at the start offset of the event
+    first = np.cumsum(size) - size
+    muon_tree = {key: hit_tree[key][first].astype(np.float32)
+                 for key in MUON_KEYS}
+    return hit_tree, muon_tree
 
+def read_nanoaod(path,
+                 cert_path: str,
+                 treepath: str = 'Events',
+                 name: str = 'rpcTnP',
+) -> Optional[tuple[dict[str, np.ndarray], dict[str, np.ndarray]]]:
+    """
+    read the rpcTnP branches once and return (hit_tree, muon_tree)
+    """
+    tree, options = _open_nanoaod(path, treepath=treepath, name=name)
     lumi_block_checker = LumiBlockChecker.from_json(cert_path)
-    mask = lumi_block_checker.get_lumi_mask(run, lumi_block)
-    hit_tree = {key: value[mask] for key, value in hit_tree.items()}
-    hit_tree = {key: np.concatenate(value) for key, value in hit_tree.items()}
+    return _split_nanoaod(tree.arrays(**options, library='np'),
+                          lumi_block_checker)
 
-    hit_tree['run'] = np.repeat(run[mask], size[mask])
-    hit_tree['event'] = np.repeat(event[mask], size[mask])
-    return hit_tree
+def _read_chunks(path,
+                 lumi_block_checker: LumiBlockChecker,
+                 step_size: Optional[Union[int, str]] = None,
+                 treepath: str = 'Events',
+                 name: str = 'rpcTnP',
+                 entry_start: Optional[int] = None,
+                 entry_stop: Optional[int] = None,
+) -> Iterator[tuple[dict[str, np.ndarray], dict[str, np.ndarray]]]:
+    tree, options = _open_nanoaod(path, treepath=treepath, name=name)
+    options.update(entry_start=entry_start, entry_stop=entry_stop)
+    if step_size is None:
+        chunks = [tree.arrays(**options, library='np')]
+    else:
+        chunks = tree.iterate(**options, step_size=step_size, library='np')
+    for chunk in chunks:
+        chunk = _split_nanoaod(chunk, lumi_block_checker)
+        if chunk is not None:
+            yield chunk
+
+def iterate_nanoaod(path,
+                    cert_path: str,
+                    step_size: Union[int, str] = '100 MB',
+                    treepath: str = 'Events',
+                    name: str = 'rpcTnP',
+) -> Iterator[tuple[dict[str, np.ndarray], dict[str, np.ndarray]]]:
+    """
+    chunked version of read_nanoaod; chunks without any certified event are
+    skipped
+    """
+    lumi_block_checker = LumiBlockChecker.from_json(cert_path)
+    yield from _read_chunks(path, lumi_block_checker, step_size=step_size,
+                            treepath=treepath, name=name)
+
+def read_nanoaod_by_hit(path,
+                        cert_path: str,
+                        treepath: str = 'Events',
+                        name: str = 'rpcTnP',
+) -> Optional[dict[str, np.ndarray]]:
+    result = read_nanoaod(path, cert_path, treepath=treepath, name=name)
+    return None if result is None else result[0]
 
 def read_nanoaod_by_muon(path,
                          cert_path: str,
                          treepath: str = 'Events',
                          name: str = 'rpcTnP',
-):
-    tree = uproot.open(f'{path}:{treepath}')
+) -> Optional[dict[str, np.ndarray]]:
+    result = read_nanoaod(path, cert_path, treepath=treepath, name=name)
+    return None if result is None else result[1]
 
-    muon_keys = ['tag_pt', 'tag_eta', 'tag_phi', 
-                 'probe_pt', 'probe_eta', 'probe_phi', 
-                 'probe_time', 'probe_dxdz', 'probe_dydz', 
-                 'dimuon_pt', 'dimuon_mass']
-    
-    aliases = {key.removeprefix(f'{name}_'): key
-               for key in tree.keys()
-               if (key.startswith(name) and key.removeprefix(f'{name}_') in muon_keys)}
-    aliases['size'] = f'n{name}'
-    expressions = list(aliases.keys()) + ['run', 'luminosityBlock', 'event']
-    cut = f'(n{name} > 0)'
-    
-    muon_tree: dict[str, np.ndarray] = tree.arrays(
-        expressions = expressions,
-        aliases = aliases,
-        cut = cut,
-        library = 'np'        
-    )
-    
-    run = muon_tree.pop('run')
-    lumi_block = muon_tree.pop('luminosityBlock')
-    size = muon_tree.pop('size')
-    event = muon_tree.pop('event')
+def _mask_hits(tree: dict[str, np.ndarray],
+               roll_table: RollTable,
+               roll_blacklist: Blacklist,
+               run_blacklist: Blacklist,
+) -> dict[str, np.ndarray]:
+    tree['roll_index'] = roll_table.get_roll_index(
+        tree['region'], tree['ring'], tree['station'], tree['sector'],
+        tree['layer'], tree['subsector'], tree['roll'])
 
-    lumi_block_checker = LumiBlockChecker.from_json(cert_path)
-    mask = lumi_block_checker.get_lumi_mask(run, lumi_block)
-    muon_tree = {key: value[mask] for key, value in muon_tree.items()}
-    for muon_key in muon_keys:
-        muon_var = []
-        for i_event in range(len(muon_tree[muon_key])):
-            muon_var.append(muon_tree[muon_key][i_event][0])
-        muon_tree[muon_key] = muon_var
-    return muon_tree
+    mask = roll_blacklist.get_mask(tree['roll_index'])
+    mask &= run_blacklist.get_mask(tree['run'])
+    return {key: value[mask] for key, value in tree.items()}
+
+def _extend_tree(output_file, key: str, chunk: ak.Array):
+    if key in output_file.keys(cycle=False):
+        output_file[key].extend(chunk)
+    else:
+        output_file[key] = chunk
+
+def _write_hists(output_file, counter: RollRunCounter):
+    hists = counter.to_hists()
+    for key in ['total_by_roll', 'passed_by_roll',
+                'total_by_run', 'passed_by_run',
+                'total_by_roll_run', 'passed_by_roll_run']:
+        output_file[key] = hists[key]
+
+@dataclass
+class FlattenCondition:
+    """
+    cert, geometry, run list and blacklists shared by every input file
+    """
+    lumi_block_checker: LumiBlockChecker
+    roll_table: RollTable
+    roll_blacklist: Blacklist
+    run_blacklist: Blacklist
+    roll_name: list[str]
+    run: list[int]
+
+    @classmethod
+    def load(cls,
+             cert_path: Path,
+             geom_path: Path,
+             run_path: Path,
+             roll_blacklist_path: Optional[str] = None,
+             run_blacklist_path: Optional[str] = None,
+             exclude_RE4 = False,
+    ):
+        roll_table = RollTable.load(geom_path)
+        # iRPC, roll blacklist and RE4 are tested at once
+        roll_blacklist = get_irpc_blacklist(roll_table)
+        roll_blacklist |= load_roll_blacklist(roll_blacklist_path, roll_table)
+        if exclude_RE4 == True:
+            roll_blacklist |= get_re4_blacklist(roll_table)
+        # a single 'run' column, read without pandas
+        run = np.genfromtxt(run_path, delimiter=',', names=True, dtype=np.int64)
+        return cls(
+            lumi_block_checker=LumiBlockChecker.from_json(cert_path),
+            roll_table=roll_table,
+            roll_blacklist=roll_blacklist,
+            run_blacklist=load_run_blacklist(run_blacklist_path),
+            roll_name=roll_table.roll_name.tolist(),
+            run=np.atleast_1d(run['run']).tolist(),
+        )
+
+    def make_counter(self) -> RollRunCounter:
+        return RollRunCounter(self.roll_name, self.run)
+
+def _flatten_chunks(input_path,
+                    condition: FlattenCondition,
+                    counter: RollRunCounter,
+                    name: str = 'rpcTnP',
+                    step_size: Optional[Union[int, str]] = None,
+                    entry_start: Optional[int] = None,
+                    entry_stop: Optional[int] = None,
+) -> Iterator[tuple[dict[str, np.ndarray], dict[str, np.ndarray]]]:
+    """
+    yield the masked (hit_tree, muon_tree) chunks of a file and count their
+    hits
+    """
+    chunks = _read_chunks(input_path, condition.lumi_block_checker,
+                          step_size=step_size, treepath='Events', name=name,
+                          entry_start=entry_start, entry_stop=entry_stop)
+    for tree, muon_tree in chunks:
+        tree = _mask_hits(
+            tree,
+            roll_table = condition.roll_table,
+            roll_blacklist = condition.roll_blacklist,
+            run_blacklist = condition.run_blacklist,
+        )
+        counter.fill(tree.pop('roll_index'), tree['run'],
+                     tree['is_fiducial'], tree['is_matched'])
+        yield apply_schema(tree, HIT_SCHEMA), apply_schema(muon_tree, MUON_SCHEMA)
 
 def flatten_nanoaod(input_path: Path,
                     cert_path: Path,
@@ -119,78 +239,139 @@ def flatten_nanoaod(input_path: Path,
                     run_blacklist_path: Optional[str] = None,
                     name: str = 'rpcTnP',
                     exclude_RE4 = False,
+                    step_size: Optional[Union[int, str]] = None,
 ):
-    tree = read_nanoaod_by_hit(
-        path = input_path,
+    """
+    step_size: if given, read the input in chunks of this many entries
+    (or bytes, e.g. '100 MB') and write the trees chunk by chunk so that
+    the memory usage does not grow with the input size
+
+    without blacklists the counts are blacklist-agnostic (only iRPC rolls
+    are dropped) and RollRunCount.apply_blacklist masks them at read time.
+    the two agree except for runs off the run axis of run_path: their hits
+    share the overflow column, so a run blacklist drops them here but
+    cannot mask them at read time. see BlacklistCheck for the comparison.
+    """
+    condition = FlattenCondition.load(
         cert_path = cert_path,
-        treepath = 'Events',
-        name = name
+        geom_path = geom_path,
+        run_path = run_path,
+        roll_blacklist_path = roll_blacklist_path,
+        run_blacklist_path = run_blacklist_path,
+        exclude_RE4 = exclude_RE4,
     )
+    counter = condition.make_counter()
 
-    tree['roll_name'] = np.array([
-        get_roll_name(tree['region'][i], tree['ring'][i], tree['station'][i],
-                      tree['sector'][i], tree['layer'][i], tree['subsector'][i], 
-                      tree['roll'][i])
-        for i in range(len(tree['region']))
-    ])
-
-    mask = np.vectorize(lambda roll: roll not in {"RE+4_R1_CH15_A", "RE+4_R1_CH16_A", "RE+3_R1_CH15_A", "RE+3_R1_CH16_A"})(tree['roll_name'])
-    if run_blacklist_path is not None:
-        mask = mask & get_run_blacklist_mask(
-            runs = tree['run'],
-            run_blacklist_path = run_blacklist_path,
-        )
-    if roll_blacklist_path is not None:
-        mask = mask & get_roll_blacklist_mask(
-            roll_name = tree['roll_name'],
-            roll_blacklist_path = roll_blacklist_path,
-        )
+    with uproot.writing.create(output_path) as output_file:
+        chunks = _flatten_chunks(input_path, condition, counter,
+                                 name=name, step_size=step_size)
+        for tree, muon_tree in chunks:
+            _extend_tree(output_file, 'tree', ak.Array(tree))
+            _extend_tree(output_file, 'muon_tree', ak.Array(muon_tree))
+        _write_hists(output_file, counter)
+        write_schema(output_file)
 
-    if exclude_RE4 == True:
-        re4_mask = np.vectorize(lambda roll: roll.startswith(('RE-4', 'RE+4')))(tree['roll_name'])
-        mask = mask & ~re4_mask
-    
-    tree = {key: value[mask] for key, value in tree.items()}
+# condition of a worker process, set once by _init_worker
+_worker_condition: Optional[FlattenCondition] = None
 
-    muon_tree = read_nanoaod_by_muon(
-        path = input_path,
+def _init_worker(condition: FlattenCondition):
+    global _worker_condition
+    _worker_condition = condition
+
+def _flatten_range(input_path,
+                   entry_start: int,
+                   entry_stop: int,
+                   name: str = 'rpcTnP',
+):
+    """
+    flatten an entry range of a file in a worker; returns its chunk (None if
+    nothing is certified) and the non-zero (roll, run) counts as flat
+    indices and values, which are much smaller than the dense arrays
+    """
+    assert _worker_condition is not None
+    counter = _worker_condition.make_counter()
+    chunks = list(_flatten_chunks(input_path, _worker_condition, counter,
+                                  name=name, entry_start=entry_start,
+                                  entry_stop=entry_stop))
+    index = np.flatnonzero(counter.total)
+    counts = (index, counter.total.flat[index], counter.passed.flat[index])
+    return (chunks[0] if chunks else None), counts
+
+def _get_entry_ranges(input_path,
+                      step_size: Optional[Union[int, str]] = None,
+                      name: str = 'rpcTnP',
+) -> list[tuple[int, int]]:
+    """
+    entry ranges of step_size entries (or bytes, e.g. '100 MB'), the whole
+    file if step_size is None
+    """
+    tree, options = _open_nanoaod(input_path, treepath='Events', name=name)
+    n_entry = tree.num_entries
+    if step_size is None:
+        step = max(n_entry, 1)
+    elif isinstance(step_size, str):
+        step = tree.num_entries_for(step_size, expressions=options['expressions'],
+                                    aliases=options['aliases'])
+    else:
+        step = step_size
+    return [(start, min(start + step, n_entry)) for start in range(0, n_entry, step)]
+
+def flatten_nanoaod_files(input_paths: Iterable[Path],
+                          cert_path: Path,
+                          geom_path: Path,
+                          run_path: Path,
+                          output_path: Path,
+                          roll_blacklist_path: Optional[str] = None,
+                          run_blacklist_path: Optional[str] = None,
+                          name: str = 'rpcTnP',
+                          exclude_RE4 = False,
+                          step_size: Optional[Union[int, str]] = None,
+                          max_workers: Optional[int] = None,
+):
+    """
+    flatten many files on a local process pool into a single output, which
+    is the same as flattening each file and merging them with hadd.
+    the conditions are loaded once and handed to each worker at start-up.
+    files are split into entry ranges of step_size (whole files if None),
+    each task flattens one range, and at most two tasks per worker are in
+    flight; the results are written in the order of input_paths, so the
+    memory usage is bounded by the in-flight ranges, not the input size.
+    blacklists behave as in flatten_nanoaod.
+    """
+    condition = FlattenCondition.load(
         cert_path = cert_path,
-        treepath = 'Events',
-        name = name
+        geom_path = geom_path,
+        run_path = run_path,
+        roll_blacklist_path = roll_blacklist_path,
+        run_blacklist_path = run_blacklist_path,
+        exclude_RE4 = exclude_RE4,
     )
+    counter = condition.make_counter()
+    tasks = ((input_path, entry_start, entry_stop)
+             for input_path in input_paths
+             for entry_start, entry_stop in _get_entry_ranges(input_path, step_size, name))
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = 2 * max_workers
 
-    geom = pd.read_csv(geom_path)
-    roll_axis = StrCategory(geom['roll_name'].tolist())
-    run = pd.read_csv(run_path)
-    run_axis = IntCategory(run['run'].tolist())
-    
-    h_total_by_roll = Hist(roll_axis) # type: ignore
-    h_passed_by_roll = h_total_by_roll.copy()
-    h_total_by_roll.fill(tree['roll_name'][tree['is_fiducial']])
-    h_passed_by_roll.fill(tree['roll_name'][tree['is_fiducial'] & tree['is_matched']])
-
-    h_total_by_run = Hist(run_axis)
-    h_passed_by_run = h_total_by_run.copy()
-    h_total_by_run.fill(tree['run'][tree['is_fiducial']])
-    h_passed_by_run.fill(tree['run'][tree['is_fiducial'] & tree['is_matched']])
-
-    h_total_by_roll_run = Hist(roll_axis, run_axis)
-    h_passed_by_roll_run = h_total_by_roll_run.copy()
-    h_total_by_roll_run.fill(tree['roll_name'][tree['is_fiducial']], tree['run'][tree['is_fiducial']])
-    h_passed_by_roll_run.fill(tree['roll_name'][tree['is_fiducial'] & tree['is_matched']], 
-                              tree['run'][tree['is_fiducial'] & tree['is_matched']])
-
-    roll_name = tree.pop('roll_name')
-    
-    tree = ak.Array(tree)
-    muon_tree = ak.Array(muon_tree)
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(condition, )) as executor, \
+         uproot.writing.create(output_path) as output_file:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(executor.submit(_flatten_range, *task, name=name))
+            while len(in_flight) >= max_in_flight:
+                _write_range(output_file, counter, in_flight.popleft().result())
+        while in_flight:
+            _write_range(output_file, counter, in_flight.popleft().result())
+        _write_hists(output_file, counter)
+        write_schema(output_file)
 
-    with uproot.writing.create(output_path) as output_file:
-        output_file['tree'] = tree
-        output_file['muon_tree'] = muon_tree
-        output_file['total_by_roll'] = h_total_by_roll
-        output_file['passed_by_roll'] = h_passed_by_roll
-        output_file['total_by_run'] = h_total_by_run
-        output_file['passed_by_run'] = h_passed_by_run
-        output_file['total_by_roll_run'] = h_total_by_roll_run
-        output_file['passed_by_roll_run'] = h_passed_by_roll_run
+def _write_range(output_file, counter: RollRunCounter, result):
+    chunk, (index, total, passed) = result
+    if chunk is not None:
+        tree, muon_tree = chunk
+        _extend_tree(output_file, 'tree', ak.Array(tree))
+        _extend_tree(output_file, 'muon_tree', ak.Array(muon_tree))
+    counter.total.reshape(-1)[index] += total
+    counter.passed.reshape(-1)[index] += passed
@@ -0,0 +1,223 @@
+import os
+from dataclasses import dataclass, replace
+from functools import cached_property
+from typing import Optional, TYPE_CHECKING
+import numpy as np
+import numpy.typing as npt
+import uproot
+
+# hist is only needed to write the counts, see RollRunCounter.to_hists
+if TYPE_CHECKING:
+    from hist.hist import Hist
+
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable, RollHierarchy
+from NanoAODTnP.RPCGeometry.RPCGeomServ import get_roll_name_table
+from NanoAODTnP.Analysis.Blacklist import Blacklist, load_run_blacklist
+
+# decoded counts keyed by (path, mtime, size, by_run), since the labelled
+# roll x run histograms take seconds to decode; oldest entries go first
+_count_cache: dict[tuple, 'RollRunCount'] = {}
+COUNT_CACHE_SIZE = 8
+
+
+@dataclass
+class RollRunCount:
+    """
+    total and passed counts of a flattened file keyed by roll and run, so that
+    roll blacklists, run blacklists and the RE4 exclusion can be applied when
+    reading instead of when flattening.
+
+    total_by_roll and passed_by_roll are kept next to the (roll, run) matrices
+    because they also count runs missing from the run axis; masking runs
+    subtracts the masked columns from them.
+    """
+    roll_name: npt.NDArray[np.str_]
+    run: npt.NDArray[np.int64]
+    total: npt.NDArray[np.float64]
+    passed: npt.NDArray[np.float64]
+    total_by_roll: npt.NDArray[np.float64]
+    passed_by_roll: npt.NDArray[np.float64]
+
+    @classmethod
+    def from_root(cls, path, by_run: bool = True):
+        """
+        by_run=False only reads the by-roll histograms and leaves the run
+        axis empty, which is enough unless runs are masked. counts are
+        cached per file and modification time, and their arrays are
+        read-only since they are shared between callers.
+        """
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+        # a full read also serves by-roll requests
+        for each in ([True] if by_run else [True, False]):
+            if key + (each, ) in _count_cache:
+                return _count_cache[key + (each, )]
+
+        count = cls._read_root(path, by_run)
+        for each in [count.total, count.passed, count.total_by_roll,
+                     count.passed_by_roll]:
+            each.flags.writeable = False
+        _count_cache[key + (by_run, )] = count
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.pop(next(iter(_count_cache)))
+        return count
+
+    @classmethod
+    def _read_root(cls, path, by_run: bool):
+        with uproot.open(path) as input_file:
+            h_total_by_roll = input_file['total_by_roll']
+            roll_name = np.array(h_total_by_roll.axis().labels(), dtype=str)
+            total_by_roll = h_total_by_roll.values()
+            passed_by_roll = input_file['passed_by_roll'].values()
+            if by_run:
+                h_total = input_file['total_by_roll_run']
+                run = np.array(h_total.axis(1).labels(), dtype=np.int64)
+                total = h_total.values()
+                passed = input_file['passed_by_roll_run'].values()
+            else:
+                run = np.zeros(0, dtype=np.int64)
+                total = np.zeros((len(roll_name), 0))
+                passed = np.zeros((len(roll_name), 0))
+        return cls(
+            roll_name=roll_name,
+            run=run,
+            total=total,
+            passed=passed,
+            total_by_roll=total_by_roll,
+            passed_by_roll=passed_by_roll,
+        )
+
+    @property
+    def total_by_run(self) -> npt.NDArray[np.float64]:
+        return self.total.sum(axis=0)
+
+    @property
+    def passed_by_run(self) -> npt.NDArray[np.float64]:
+        return self.passed.sum(axis=0)
+
+    @cached_property
+    def roll_table(self) -> RollTable:
+        """
+        shared by every count with the same roll axis, e.g. masked copies
+        """
+        return get_roll_name_table(self.roll_name)
+
+    @cached_property
+    def hierarchy(self) -> RollHierarchy:
+        return self.roll_table.hierarchy
+
+    def sum_by_group(self, level: str) -> tuple[npt.NDArray[np.float64],
+                                                npt.NDArray[np.float64]]:
+        """
+        (total, passed) of each group of a hierarchy level by run, with the
+        group names in hierarchy.group_name[level]
+        """
+        return (self.hierarchy.sum(self.total, level),
+                self.hierarchy.sum(self.passed, level))
+
+    def mask_rolls(self, roll_mask: npt.NDArray[np.bool_]) -> 'RollRunCount':
+        """
+        zero the counts of rolls where roll_mask is False
+        """
+        keep = roll_mask.astype(np.float64)
+        return replace(self,
+                       total=self.total * keep[:, np.newaxis],
+                       passed=self.passed * keep[:, np.newaxis],
+                       total_by_roll=self.total_by_roll * keep,
+                       passed_by_roll=self.passed_by_roll * keep)
+
+    def mask_runs(self, run_mask: npt.NDArray[np.bool_]) -> 'RollRunCount':
+        """
+        zero the counts of runs where run_mask is False. the masked counts
+        are subtracted from total_by_roll and passed_by_roll, so hits of runs
+        missing from the run axis (its overflow) are kept; they cannot be
+        masked here, unlike with a run blacklist applied when flattening.
+        """
+        if np.all(run_mask):
+            return self
+        masked = ~np.asarray(run_mask, dtype=bool)
+        return replace(self,
+                       total=self.total * ~masked,
+                       passed=self.passed * ~masked,
+                       total_by_roll=self.total_by_roll - (self.total * masked).sum(axis=1),
+                       passed_by_roll=self.passed_by_roll - (self.passed * masked).sum(axis=1))
+
+    def apply_blacklist(self,
+                        roll_blacklist_path: Optional[str] = None,
+                        run_blacklist_path: Optional[str] = None,
+                        exclude_RE4: bool = False,
+    ) -> 'RollRunCount':
+        roll_mask = Blacklist.from_json(roll_blacklist_path).get_mask(self.roll_name)
+        if exclude_RE4:
+            roll_mask &= ~self.hierarchy.get_mask('Disk4')
+        if run_blacklist_path is not None and len(self.run) == 0:
+            raise ValueError('no run axis to mask, read with by_run=True')
+        run_mask = load_run_blacklist(run_blacklist_path).get_mask(self.run)
+        return self.mask_rolls(roll_mask).mask_runs(run_mask)
+
+
+class RollRunCounter:
+    """
+    dense int64 (roll, run) counts of total and passed hits filled with
+    bincount on roll and run indices. the last row and column collect hits
+    of unknown rolls and runs, like the overflow bins of the category axes.
+    """
+
+    def __init__(self, roll_name: list[str], run: list[int]):
+        self.roll_name = list(roll_name)
+        self.run = np.asarray(run, dtype=np.int64)
+        self._run_sorter = np.argsort(self.run)
+        self._sorted_run = self.run[self._run_sorter]
+        shape = (len(self.roll_name) + 1, len(self.run) + 1)
+        self.total = np.zeros(shape, dtype=np.int64)
+        self.passed = np.zeros(shape, dtype=np.int64)
+
+    def get_run_index(self, run: npt.ArrayLike) -> npt.NDArray[np.int64]:
+        """
+        index on the run axis, len(run) for runs not on the axis
+        """
+        run = np.asarray(run, dtype=np.int64)
+        n_run = len(self.run)
+        if n_run == 0:
+            return np.zeros(run.shape, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_run, run), n_run - 1)
+        index = self._run_sorter[pos]
+        return np.where(self._sorted_run[pos] == run, index, n_run)
+
+    def fill(self,
+             roll_index: npt.NDArray[np.int64],
+             run: npt.NDArray[np.int64],
+             is_fiducial: npt.NDArray[np.bool_],
+             is_matched: npt.NDArray[np.bool_],
+    ):
+        """
+        roll_index is the RollTable index (-1 for unknown rolls)
+        """
+        n_roll, n_run = self.total.shape
+        roll_index = np.where(roll_index < 0, n_roll - 1, roll_index)
+        index = roll_index * n_run + self.get_run_index(run)
+        passed = is_fiducial & is_matched
+        self.total += np.bincount(index[is_fiducial], minlength=n_roll * n_run
+                                  ).reshape(n_roll, n_run)
+        self.passed += np.bincount(index[passed], minlength=n_roll * n_run
+                                   ).reshape(n_roll, n_run)
+
+    def to_hists(self) -> dict[str, 'Hist']:
+        """
+        the six by_roll, by_run and by_roll_run projections, including the
+        overflow bins
+        """
+        from hist.hist import Hist
+        from hist.axis import StrCategory, IntCategory
+        roll_axis = StrCategory(self.roll_name)
+        run_axis = IntCategory(self.run.tolist())
+        hists = {}
+        for which in ['total', 'passed']:
+            count = getattr(self, which).astype(np.float64)
+            hists[f'{which}_by_roll'] = Hist(roll_axis) # type: ignore
+            hists[f'{which}_by_roll'].view(flow=True)[:] = count.sum(axis=1)
+            hists[f'{which}_by_run'] = Hist(run_axis)
+            hists[f'{which}_by_run'].view(flow=True)[:] = count.sum(axis=0)
+            hists[f'{which}_by_roll_run'] = Hist(roll_axis, run_axis)
+            hists[f'{which}_by_roll_run'].view(flow=True)[:] = count
+        return hists
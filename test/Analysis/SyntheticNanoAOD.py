@@ -0,0 +1,261 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import numpy.typing as npt
+import awkward as ak
+import uproot
+
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable
+from NanoAODTnP.Analysis.LumiBlockChecker import LumiBlockChecker
+from NanoAODTnP.Analysis.NanoAOD import MUON_KEYS
+
+ID_BRANCHES = ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']
+MEASUREMENT_BRANCHES = ['residual_x', 'residual_y', 'pull_x', 'pull_y',
+                        'pull_x_v2', 'pull_y_v2']
+# value of the measurements of hits without a matched RPC hit
+UNMATCHED = -999
+
+
+@dataclass
+class TrackTable:
+    """
+    rolls a probe can cross on its way out, grouped by track (wheel and
+    sector in the barrel, endcap side, ring and sector in the endcap) and
+    by slot (detector unit, e.g. RB1in or RE+2) with -1 padding:
+    roll[track, slot, :n_roll[track, slot]]
+    """
+    roll: npt.NDArray[np.int64]
+    n_roll: npt.NDArray[np.int64]
+
+    @classmethod
+    def from_roll_table(cls, roll_table: RollTable):
+        barrel = roll_table.barrel
+        track_keys = np.stack([
+            roll_table.region,
+            np.where(barrel, roll_table.ring, 0),
+            np.where(barrel, 0, roll_table.ring),
+            roll_table.sector,
+        ], axis=1)
+        _, track = np.unique(track_keys, axis=0, return_inverse=True)
+        _, slot = np.unique(roll_table.detector_unit, return_inverse=True)
+        track, slot = track.reshape(-1), slot.reshape(-1)
+
+        n_track, n_slot = track.max() + 1, slot.max() + 1
+        n_roll = np.zeros((n_track, n_slot), dtype=np.int64)
+        np.add.at(n_roll, (track, slot), 1)
+
+        # position of every roll inside its (track, slot) cell
+        order = np.lexsort((slot, track))
+        cell = track[order] * n_slot + slot[order]
+        first = np.searchsorted(cell, cell)
+        roll = np.full((n_track, n_slot, n_roll.max()), -1, dtype=np.int64)
+        roll[track[order], slot[order], np.arange(len(order)) - first] = order
+        return cls(roll, n_roll)
+
+
+def _get_certified_ranges(checker: LumiBlockChecker,
+                          first_run: Optional[int],
+                          last_run: Optional[int],
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    run, first lumi section and number of lumi sections of every certified
+    range of runs in [first_run, last_run]
+    """
+    keys = checker.restrict_runs(first_run, last_run).keys
+    if len(keys) == 0:
+        raise ValueError(f'no certified run in [{first_run}, {last_run}]')
+    start, end = keys[0::2], keys[1::2]
+    # (first, last] ranges
+    return start >> 32, (start & 0xFFFFFFFF) + 1, end - start
+
+
+def _generate_lumi(rng: np.random.Generator,
+                   checker: LumiBlockChecker,
+                   n_event: int,
+                   first_run: Optional[int],
+                   last_run: Optional[int],
+                   uncertified_fraction: float,
+) -> tuple[npt.NDArray[np.uint32], npt.NDArray[np.uint32]]:
+    """
+    (run, luminosityBlock) sorted like a real file; certified lumi sections
+    are drawn uniformly, the others right after the certified ranges
+    """
+    run, first, length = _get_certified_ranges(checker, first_run, last_run)
+    index = rng.choice(len(run), n_event, p=length / length.sum())
+    lumi = first[index] + (rng.random(n_event) * length[index]).astype(np.int64)
+
+    # just past the end of a range, which may fall into the next one
+    uncertified = rng.random(n_event) < uncertified_fraction
+    past_end = first[index] + length[index] + rng.integers(0, 50, n_event)
+    lumi = np.where(uncertified, past_end, lumi)
+
+    run = run[index]
+    order = np.lexsort((lumi, run))
+    return run[order].astype(np.uint32), lumi[order].astype(np.uint32)
+
+
+def _get_roll_direction(roll_table: RollTable
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    eta and phi of the roll centers
+    """
+    x, y, z = [each.mean(axis=1) for each in (roll_table.x, roll_table.y,
+                                              roll_table.z)]
+    eta = np.arcsinh(z / np.hypot(x, y))
+    return eta, np.arctan2(y, x)
+
+
+class SyntheticNanoAOD:
+    """
+    NanoAOD-shaped Events trees with the rpcTnP branches of
+    muRPCTnPFlatTableProducer for benchmarks without access to the real
+    inputs: one probe per event crossing one roll per detector unit of a
+    barrel sector or an endcap sector, with per-roll efficiencies, Z-like
+    tag-and-probe kinematics and runs and lumi sections from a golden json
+    """
+
+    def __init__(self,
+                 roll_table: RollTable,
+                 lumi_block_checker: LumiBlockChecker,
+                 seed: int = 0,
+                 acceptance: float = 0.9,
+                 fiducial_fraction: float = 0.85,
+                 efficiency: float = 0.95,
+                 dead_fraction: float = 0.01,
+                 uncertified_fraction: float = 0.05,
+    ):
+        assert roll_table.x is not None
+        self.roll_table = roll_table
+        self.lumi_block_checker = lumi_block_checker
+        self.rng = np.random.default_rng(seed)
+        self.acceptance = acceptance
+        self.fiducial_fraction = fiducial_fraction
+        self.uncertified_fraction = uncertified_fraction
+        self.track_table = TrackTable.from_roll_table(roll_table)
+        self.eta, self.phi = _get_roll_direction(roll_table)
+
+        # a few dead rolls make the detector maps less uniform
+        n_roll = len(roll_table)
+        self.roll_efficiency = np.clip(self.rng.normal(efficiency, 0.02, n_roll), 0, 1)
+        self.roll_efficiency[self.rng.random(n_roll) < dead_fraction] = 0
+
+    @classmethod
+    def from_path(cls, geom_path: Path, cert_path: Path, **kwargs):
+        return cls(RollTable.load(geom_path), LumiBlockChecker.from_json(cert_path),
+                   **kwargs)
+
+    def _generate_hits(self, n_event: int
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """
+        roll index of every hit and the number of hits of each event
+        """
+        table = self.track_table
+        n_track, n_slot, _ = table.roll.shape
+        n_roll_by_track = table.n_roll.sum(axis=1)
+        track = self.rng.choice(n_track, n_event,
+                                p=n_roll_by_track / n_roll_by_track.sum())
+        n_roll = table.n_roll[track]
+        pick = (self.rng.random((n_event, n_slot)) * n_roll).astype(np.int64)
+        roll = table.roll[track[:, np.newaxis], np.arange(n_slot), pick]
+        crossed = (n_roll > 0) & (self.rng.random((n_event, n_slot)) < self.acceptance)
+        return roll[crossed], crossed.sum(axis=1)
+
+    def generate(self, run: npt.NDArray[np.uint32],
+                 lumi: npt.NDArray[np.uint32],
+                 event: npt.NDArray[np.uint64],
+                 name: str = 'rpcTnP',
+    ) -> dict[str, object]:
+        """
+        branches of the Events tree for the given events
+        """
+        rng = self.rng
+        n_event = len(run)
+        roll, size = self._generate_hits(n_event)
+        n_hit = len(roll)
+
+        hits = {key: getattr(self.roll_table, key)[roll].astype(np.int32)
+                for key in ID_BRANCHES}
+        hits['is_fiducial'] = rng.random(n_hit) < self.fiducial_fraction
+        hits['is_matched'] = rng.random(n_hit) < self.roll_efficiency[roll]
+        matched = hits['is_matched']
+        hits['cls'] = np.where(matched, 1 + rng.geometric(0.45, n_hit),
+                               UNMATCHED).astype(np.int32)
+        hits['bx'] = np.where(matched, np.round(rng.normal(0, 0.3, n_hit)),
+                              UNMATCHED).astype(np.int32)
+        for key, width in zip(MEASUREMENT_BRANCHES, [1.5, 3.0, 1.0, 1.0, 1.0, 1.0]):
+            hits[key] = np.where(matched, rng.normal(0, width, n_hit),
+                                 UNMATCHED).astype(np.float32)
+
+        # the probe points to its first roll
+        first = np.minimum(np.cumsum(size) - size, max(n_hit - 1, 0))
+        probe_roll = roll[first] if n_hit > 0 else np.zeros(n_event, dtype=np.int64)
+        muon = {
+            'tag_pt': 26 + rng.exponential(15, n_event),
+            'tag_eta': rng.uniform(-2.4, 2.4, n_event),
+            'tag_phi': rng.uniform(-np.pi, np.pi, n_event),
+            'probe_pt': 20 + rng.exponential(20, n_event),
+            'probe_eta': self.eta[probe_roll] + rng.normal(0, 0.02, n_event),
+            'probe_phi': self.phi[probe_roll] + rng.normal(0, 0.01, n_event),
+            'probe_time': rng.normal(0, 2, n_event),
+            'probe_dxdz': rng.normal(0, 0.2, n_event),
+            'probe_dydz': rng.normal(0, 0.2, n_event),
+            'dimuon_pt': rng.exponential(15, n_event),
+            'dimuon_mass': rng.normal(91.2, 2.5, n_event),
+        }
+        # muon variables are repeated for every hit like in the producer
+        for key in MUON_KEYS:
+            hits[key] = np.repeat(muon[key].astype(np.float32), size)
+
+        return {
+            'run': run,
+            'luminosityBlock': lumi,
+            'event': event,
+            name: ak.zip({key: ak.unflatten(value, size)
+                          for key, value in hits.items()}),
+        }
+
+    def write(self, output_path: Path,
+              n_event: int,
+              first_run: Optional[int] = None,
+              last_run: Optional[int] = None,
+              chunk_size: int = 100_000,
+              name: str = 'rpcTnP',
+    ):
+        """
+        write n_event events in baskets of chunk_size events
+        """
+        run, lumi = _generate_lumi(self.rng, self.lumi_block_checker, n_event,
+                                   first_run, last_run,
+                                   self.uncertified_fraction)
+        event = np.arange(1, n_event + 1, dtype=np.uint64) * 7919
+        with uproot.recreate(output_path) as output_file:
+            tree = None
+            for start in range(0, n_event, chunk_size):
+                chunk = slice(start, start + chunk_size)
+                branches = self.generate(run[chunk], lumi[chunk], event[chunk],
+                                         name=name)
+                if tree is None:
+                    # a TTree with the n{name} counter like NanoAOD
+                    tree = output_file.mktree('Events', {
+                        key: value.type.content if isinstance(value, ak.Array)
+                        else value.dtype
+                        for key, value in branches.items()
+                    })
+                tree.extend(branches)
+
+
+def make_synthetic_nanoaod(output_path: Path,
+                           geom_path: Path,
+                           cert_path: Path,
+                           n_event: int,
+                           first_run: Optional[int] = None,
+                           last_run: Optional[int] = None,
+                           seed: int = 0,
+                           chunk_size: int = 100_000,
+                           name: str = 'rpcTnP',
+                           **kwargs,
+):
+    generator = SyntheticNanoAOD.from_path(geom_path, cert_path, seed=seed, **kwargs)
+    generator.write(output_path, n_event, first_run=first_run, last_run=last_run,
+                    chunk_size=chunk_size, name=name)
@@ -0,0 +1,149 @@
+import json
+from collections.abc import Mapping
+from typing import Callable, Optional
+import numpy as np
+import uproot
+
+SCHEMA_KEY = 'schema'
+
+# ids fit into a byte, cls and bx keep room for the sentinel of unmatched
+# hits (e.g. bx = -999), flags stay ROOT bool (one byte each) and the
+# producer already stores the kinematics and residuals in single precision
+HIT_SCHEMA = {
+    'region': 'int8',
+    'ring': 'int8',
+    'station': 'uint8',
+    'sector': 'uint8',
+    'layer': 'uint8',
+    'subsector': 'uint8',
+    'roll': 'uint8',
+    'is_fiducial': 'bool',
+    'is_matched': 'bool',
+    'cls': 'int16',
+    'bx': 'int16',
+    'residual_x': 'float32',
+    'residual_y': 'float32',
+    'pull_x': 'float32',
+    'pull_y': 'float32',
+    'pull_x_v2': 'float32',
+    'pull_y_v2': 'float32',
+    'tag_pt': 'float32',
+    'tag_eta': 'float32',
+    'tag_phi': 'float32',
+    'probe_pt': 'float32',
+    'probe_eta': 'float32',
+    'probe_phi': 'float32',
+    'probe_time': 'float32',
+    'probe_dxdz': 'float32',
+    'probe_dydz': 'float32',
+    'dimuon_pt': 'float32',
+    'dimuon_mass': 'float32',
+    'run': 'uint32',
+    'event': 'uint64',
+}
+
+MUON_SCHEMA = {
+    'tag_pt': 'float32',
+    'tag_eta': 'float32',
+    'tag_phi': 'float32',
+    'probe_pt': 'float32',
+    'probe_eta': 'float32',
+    'probe_phi': 'float32',
+    'probe_time': 'float32',
+    'probe_dxdz': 'float32',
+    'probe_dydz': 'float32',
+    'dimuon_pt': 'float32',
+    'dimuon_mass': 'float32',
+}
+
+SCHEMA = {'tree': HIT_SCHEMA, 'muon_tree': MUON_SCHEMA}
+
+
+def apply_schema(tree: dict[str, np.ndarray],
+                 schema: dict[str, str],
+) -> dict[str, np.ndarray]:
+    """
+    cast the columns listed in the schema, other columns are kept as they are
+    """
+    return {key: value.astype(schema[key], copy=False) if key in schema else value
+            for key, value in tree.items()}
+
+def write_schema(output_file, schema: dict[str, dict[str, str]] = SCHEMA):
+    output_file[SCHEMA_KEY] = json.dumps(schema)
+
+def read_schema(input_file) -> dict[str, dict[str, str]]:
+    """
+    schema recorded in a flattened file; files written before the schema
+    was recorded get the default one
+    """
+    if SCHEMA_KEY in input_file.keys(cycle=False):
+        return json.loads(str(input_file[SCHEMA_KEY]))
+    return SCHEMA
+
+def read_tree(input_path,
+              expressions: Optional[list[str]] = None,
+              key: str = 'tree',
+) -> dict[str, np.ndarray]:
+    """
+    read a flattened tree with the dtypes of its schema
+    """
+    with uproot.open(input_path) as input_file:
+        schema = read_schema(input_file).get(key, {})
+        tree = input_file[key].arrays(expressions, library='np')
+    return apply_schema(tree, schema)
+
+
+class LazyTree(Mapping):
+    """
+    columns of a flattened tree read on first access with the dtypes of its
+    schema and kept afterwards; derived maps the name of a computed column
+    to a function of this tree, e.g. roll_index from the ids. iteration is
+    over the branch and derived column names, so values() or items() read
+    every column.
+    """
+
+    def __init__(self, input_path,
+                 key: str = 'tree',
+                 derived: Optional[dict[str, Callable[['LazyTree'], np.ndarray]]] = None,
+    ):
+        self.input_path = input_path
+        self.key = key
+        self.derived = dict(derived or {})
+        with uproot.open(input_path) as input_file:
+            self.schema = read_schema(input_file).get(key, {})
+            self.branches = list(input_file[key].keys())
+        self._columns = {}
+
+    def read(self, expressions: list[str]) -> dict[str, np.ndarray]:
+        """
+        read branches without keeping them, e.g. inputs of derived columns
+        """
+        with uproot.open(self.input_path) as input_file:
+            tree = input_file[self.key].arrays(expressions, library='np')
+        return apply_schema(tree, self.schema)
+
+    def load(self, keys: list[str]):
+        """
+        read the missing branches among keys at once
+        """
+        missing = [each for each in keys
+                   if each in self.branches and each not in self._columns]
+        if missing:
+            self._columns.update(self.read(missing))
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if key not in self._columns:
+            if key in self.derived:
+                self._columns[key] = self.derived[key](self)
+            elif key in self.branches:
+                self.load([key])
+            else:
+                raise KeyError(key)
+        return self._columns[key]
+
+    def __iter__(self):
+        yield from self.branches
+        yield from (each for each in self.derived if each not in self.branches)
+
+    def __len__(self) -> int:
+        return len(set(self.branches) | set(self.derived))
@@ -0,0 +1,47 @@
+import os
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+CACHE_DIR_ENV = 'NANOAODTNP_CACHE_DIR'
+
+
+def get_cache_dir() -> Path:
+    """
+    ${NANOAODTNP_CACHE_DIR} or ~/.cache/NanoAODTnP
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is None:
+        return Path.home() / '.cache' / 'NanoAODTnP'
+    return Path(cache_dir)
+
+
+def get_cache_path(kind: str,
+                   content: bytes,
+                   version: int,
+                   suffix: str,
+                   cache_dir: Optional[Path] = None,
+) -> Path:
+    """
+    cache_dir/kind/v{version}/{sha256 of content}{suffix}, so that a new
+    layout of the cached files only needs a new version
+    """
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+    name = f'{hashlib.sha256(content).hexdigest()}{suffix}'
+    return cache_dir / kind / f'v{version}' / name
+
+
+def write_cache(cache_path: Path, write: Callable[[BinaryIO], None]):
+    """
+    write(stream) to a temporary file renamed to cache_path, so that
+    concurrent jobs never read a partial file; nothing is cached if the
+    cache directory is not writable
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as stream:
+            write(stream)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
@@ -1,15 +1,59 @@
-import json
 import numpy as np
-import uproot
 import math
 import copy
+import functools
 import mplhep as mh
 import matplotlib.pyplot as plt
 import pandas as pd
+from collections.abc import Mapping
 from pathlib import Path
-from typing import Optional, Union, List, Dict
+from typing import Callable, Optional, Union, List, Dict
 
-from NanoAODTnP.RPCGeometry.RPCGeomServ import get_segment, get_roll_name
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable, select_roll_names
+from NanoAODTnP.Analysis.Blacklist import Blacklist, load_roll_blacklist, load_run_blacklist, get_irpc_blacklist
+from NanoAODTnP.Analysis.RollRunCount import RollRunCount
+from NanoAODTnP.Analysis.TreeSchema import LazyTree
+
+
+class TreeView(Mapping):
+    """
+    columns of a tree restricted to the selected entries; a column is
+    gathered on first access, so views share the arrays of the full tree
+    and only cost the index and the columns actually used.
+
+    only keyed access is lazy: len and iteration are over the column names
+    of the full tree, so values(), items() or dict(view) gather (and, for
+    a LazyTree, read) every column; select the columns by name instead,
+    e.g. {key: view[key] for key in ['cls', 'bx']}
+    """
+
+    def __init__(self, columns: Mapping, index: Optional[np.ndarray] = None):
+        self.columns = columns
+        self.index = index
+        self._cache = {}
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if self.index is None:
+            return self.columns[key]
+        if key not in self._cache:
+            self._cache[key] = self.columns[key][self.index]
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def select(self, mask: np.ndarray) -> 'TreeView':
+        """
+        view of the entries where mask (over this view) is True
+        """
+        index = np.flatnonzero(mask) if self.index is None else self.index[mask]
+        return TreeView(self.columns, index)
+
+
+ID_VARS = ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']
 
 
 class DataLoader:
@@ -22,63 +66,97 @@ class DataLoader:
         var: list = [],
     ):
         self.input_path = input_path
-        self.geom = pd.read_csv(geom_path)
+        self.roll_table = RollTable.load(geom_path)
         self.roll_blacklist = self.load_roll_blacklist(roll_blacklist_path)
         self.run_blacklist = self.load_run_blacklist(run_blacklist_path)
         self.var = var
         self.tree = self.load_tree()
         self.roll_names = self.load_roll_names()
-        self.total_by_roll = self.load_count('total_by_roll')
-        self.passed_by_roll = self.load_count('passed_by_roll')
+        # counts with and without the run blacklist, read on first use and
+        # shared with filtered views
+        self._counts = {}
         self.region = 'All'
         self.facecolors = ['#8EFFF9', '#00AEC9']
         self.edgecolors = ['#005F77', '#005F77']
         self.hatches = ['///', None]
 
-    def load_roll_blacklist(self, roll_blacklist_path: Optional[Path]) -> set:
-        if roll_blacklist_path is None:
-            return set()
-        with open(roll_blacklist_path) as stream:
-            return set(json.load(stream))
+    def load_roll_blacklist(self, roll_blacklist_path: Optional[Path]) -> Blacklist:
+        return load_roll_blacklist(roll_blacklist_path, self.roll_table)
     
-    def load_run_blacklist(self, run_blacklist_path: Optional[Path]) -> set:
-        if run_blacklist_path is None:
-            return set()
-        with open(run_blacklist_path) as stream:
-            return set(json.load(stream))
-
-    def load_tree(self) -> dict:
-        input_var = self.var + ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll', 'is_fiducial', 'is_matched']
-        tree = uproot.open(f'{self.input_path}:tree').arrays(input_var, library='np')
-        tree['roll_name'] = np.array([
-            get_roll_name(tree['region'][i], tree['ring'][i], tree['station'][i],
-                          tree['sector'][i], tree['layer'][i], tree['subsector'][i], tree['roll'][i])
-            for i in range(len(tree['region']))
-        ])
-        self.var = self.var + ['is_fiducial', 'is_matched', 'roll_name']
-        for id_var in ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']:
-            tree.pop(id_var)
-        return tree
-
-    def load_roll_names(self, is_region: Optional[np.vectorize] = None, linked: bool = False) -> np.ndarray:
-        roll_names = np.unique(self.geom['roll_name'])  
+    def load_run_blacklist(self, run_blacklist_path: Optional[Path]) -> Blacklist:
+        return load_run_blacklist(run_blacklist_path)
 
-        is_iRPC = np.vectorize(lambda item: item in {"RE+4_R1_CH15_A", "RE+4_R1_CH16_A", "RE+3_R1_CH15_A", "RE+3_R1_CH16_A"})
-        mask = ~is_iRPC(roll_names)
+    def load_tree(self) -> LazyTree:
+        # columns are read from the file when first used, var only lists
+        # the columns of interest
+        self.var = self.var + ['is_fiducial', 'is_matched', 'roll_name']
+        return LazyTree(self.input_path, derived={
+            'roll_index': self.get_roll_index,
+            'roll_name': functools.partial(self.get_roll_column, self.roll_table.roll_name),
+            'detector_unit': functools.partial(self.get_roll_column, self.roll_table.detector_unit),
+            'wheel_disk': functools.partial(self.get_group_column, 'wheel_disk'),
+            'disk_group': functools.partial(self.get_group_column, 'disk_group'),
+        })
+
+    def get_roll_index(self, tree: LazyTree) -> np.ndarray:
+        ids = tree.read(ID_VARS)
+        return self.roll_table.get_roll_index(*[ids[each] for each in ID_VARS])
+
+    def get_roll_column(self, values: np.ndarray, tree: LazyTree) -> np.ndarray:
+        # per-roll values for every hit, '' for hits outside the geometry
+        return np.append(values, '')[tree['roll_index']]
+
+    def get_group_column(self, level: str, tree: LazyTree) -> np.ndarray:
+        hierarchy = self.roll_table.hierarchy
+        names = hierarchy.group_name[level][hierarchy.group_id[level]]
+        return self.get_roll_column(names, tree)
+
+    @property
+    def count(self) -> RollRunCount:
+        return RollRunCount.from_root(self.input_path)
+
+    @functools.cached_property
+    def total_by_roll(self) -> np.ndarray:
+        return self.load_count('total_by_roll', roll_names=self.load_roll_names())
+
+    @functools.cached_property
+    def passed_by_roll(self) -> np.ndarray:
+        return self.load_count('passed_by_roll', roll_names=self.load_roll_names())
+
+    def load_roll_names(self, is_region: Optional[Callable] = None, linked: bool = False) -> np.ndarray:
+        roll_names = np.unique(self.roll_table.roll_name)  
+        roll_index = self.roll_table.get_roll_index_by_name(roll_names)
+
+        mask = get_irpc_blacklist(self.roll_table).get_mask(roll_index)
         if is_region is not None:
             region_mask = is_region(roll_names)
             mask = mask & region_mask
         if linked == True:
-            is_linked = np.vectorize(lambda item: item not in self.roll_blacklist)
-            link_mask = is_linked(roll_names)
+            link_mask = self.roll_blacklist.get_mask(roll_index)
             mask = mask & link_mask
 
         return roll_names[mask]
 
-    def load_count(self, which:str = 'total_by_roll') -> np.ndarray:
-        hist = uproot.open(f'{self.input_path}:{which}').to_hist()
-        count = hist[self.roll_names.tolist()].values()
-        return count
+    def get_count(self, safetime: bool = False) -> RollRunCount:
+        # blacklists are applied here, the flattened file is blacklist-agnostic
+        if safetime not in self._counts:
+            if safetime == True:
+                count = self.count
+                count = count.mask_runs(self.run_blacklist.get_mask(count.run))
+            else:
+                # the run axis is only needed to mask runs
+                count = RollRunCount.from_root(self.input_path, by_run=False)
+            self._counts[safetime] = count
+        return self._counts[safetime]
+
+    def load_count(self, which:str = 'total_by_roll', safetime: bool = False,
+                   roll_names: Optional[np.ndarray] = None) -> np.ndarray:
+        count = self.get_count(safetime)
+        if roll_names is None:
+            roll_names = self.roll_names
+        index = pd.Index(count.roll_name).get_indexer(roll_names)
+        # rolls missing from the file have no hits
+        return np.where(index >= 0, getattr(count, which)[index], 0)
 
     def get_mask(self, key: str) -> np.ndarray:
         mask = True
@@ -87,9 +165,9 @@ class DataLoader:
         if key == 'is_matched':
             mask = self.tree['is_matched']
         if key == 'is_linked':
-            mask = np.vectorize(lambda name: name not in self.roll_blacklist)(self.tree['roll_name'])
+            mask = self.roll_blacklist.get_mask(self.tree['roll_index'])
         if key == 'is_safetime':
-            mask = np.vectorize(lambda run: str(run) not in self.run_blacklist)(self.tree['run'])
+            mask = self.run_blacklist.get_mask(self.tree['run'])
         return mask
 
     def get_region_params(self, region: str) -> dict:
@@ -104,30 +182,26 @@ class DataLoader:
                            'Disk4': ['#CC0000', '#CC0000']}
 
         hatches = ['///', None]
-        is_region = np.vectorize(lambda item: item.startswith(region))
+        # All, Barrel, Endcap, Disk4, W-2, RE+1, ... or any RollSelector expression
+        is_region = lambda roll_name: select_roll_names(roll_name, region, self.roll_table)
         facecolors = facecolor_table['All']
         edgecolors = edgecolor_table['All']
 
         if region == 'All':
             facecolors = facecolor_table[region]
             edgecolors = edgecolor_table[region]
-            is_region = np.vectorize(lambda item: type(item) is str)
         elif region == 'Barrel':
             facecolors = facecolor_table[region]
             edgecolors = edgecolor_table[region]
-            is_region = np.vectorize(lambda item: item.startswith('W'))
         elif region == 'Endcap':
             facecolors = facecolor_table['Disk123']
             edgecolors = edgecolor_table['Disk123']
-            is_region = np.vectorize(lambda item: item.startswith('RE'))
         elif region == 'Disk123':
             facecolors = facecolor_table[region]
             edgecolors = edgecolor_table[region]
-            is_region = np.vectorize(lambda item: item.startswith(('RE+1', 'RE+2', 'RE+3', 'RE-1', 'RE-2', 'RE-3')))
         elif region == 'Disk4':
             facecolors = facecolor_table[region]
             edgecolors = edgecolor_table[region]
-            is_region = np.vectorize(lambda item: item.startswith(('RE+4', 'RE-4')))
         elif region.startswith('W'):
             facecolors = facecolor_table['Barrel']
             edgecolors = edgecolor_table['Barrel']
@@ -145,26 +219,30 @@ class DataLoader:
             'hatches': hatches
         }
 
-    def filter_data(self, keys: Union[str, list] = [], region = 'All') -> dict:
+    def filter_data(self, keys: Union[str, list] = [], region = 'All') -> 'DataLoader':
         # keys: ['is_matched', 'is_fiducial', 'is_linked', 'is_safetime']
-        mask = self.get_region_params(region)['is_region'](self.tree['roll_name'])
+        # the result is a shallow copy whose tree is a TreeView of this one
+        region_params = self.get_region_params(region)
+        region_mask = np.append(self.roll_table.select(region), False)
+        mask = region_mask[self.tree['roll_index']]
         if type(keys) is str:
             mask = mask & self.get_mask(keys)
         elif type(keys) is list:
             for key in keys:
                 mask = mask & self.get_mask(key)
 
-        filtered_data = copy.deepcopy(self)
-        filtered_data.tree = {key: values[mask] for key, values in filtered_data.tree.items()}
+        filtered_data = copy.copy(self)
+        tree = self.tree if isinstance(self.tree, TreeView) else TreeView(self.tree)
+        filtered_data.tree = tree.select(mask)
         if 'is_linked' in keys:
-            filtered_data.roll_names = filtered_data.load_roll_names(filtered_data.get_region_params(region)['is_region'], linked = True)
+            filtered_data.roll_names = filtered_data.load_roll_names(region_params['is_region'], linked = True)
         else:
-            filtered_data.roll_names = filtered_data.load_roll_names(filtered_data.get_region_params(region)['is_region'])
+            filtered_data.roll_names = filtered_data.load_roll_names(region_params['is_region'])
 
-        filtered_data.total = filtered_data.load_count('total_by_roll')
-        filtered_data.passed = filtered_data.load_count('passed_by_roll')
+        filtered_data.total = filtered_data.load_count('total_by_roll', safetime = 'is_safetime' in keys)
+        filtered_data.passed = filtered_data.load_count('passed_by_roll', safetime = 'is_safetime' in keys)
         filtered_data.region = region
-        filtered_data.facecolors = filtered_data.get_region_params(region)['facecolors']
-        filtered_data.edgecolors = filtered_data.get_region_params(region)['edgecolors']
-        filtered_data.hatches = filtered_data.get_region_params(region)['hatches']
+        filtered_data.facecolors = region_params['facecolors']
+        filtered_data.edgecolors = region_params['edgecolors']
+        filtered_data.hatches = region_params['hatches']
         return filtered_data
@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+import matplotlib.pyplot as plt
+
+
+@dataclass
+class FigureJob:
+    """
+    one independent figure: func(data, **kwargs) when the pool holds data,
+    func(**kwargs) otherwise; func and kwargs must be picklable, i.e. module
+    level functions, and output_path is where func saves the figure
+    """
+    func: Callable
+    kwargs: dict = field(default_factory=dict)
+    output_path: Optional[Path] = None
+
+
+@dataclass
+class JobTiming:
+    output_path: Optional[Path]
+    elapsed: float
+
+
+# data of a worker process, set once by _init_worker
+_worker_data: Any = None
+
+def _init_worker(data: Any, load_data: Optional[Callable]):
+    global _worker_data
+    plt.switch_backend('Agg')
+    _worker_data = load_data() if load_data is not None else data
+
+def _render(job: FigureJob, data: Any) -> JobTiming:
+    start = time.perf_counter()
+    # only the figures of the job are closed, not those of the caller
+    open_figures = set(plt.get_fignums())
+    if data is None:
+        job.func(**job.kwargs)
+    else:
+        job.func(data, **job.kwargs)
+    for num in set(plt.get_fignums()) - open_figures:
+        plt.close(num)
+    return JobTiming(job.output_path, time.perf_counter() - start)
+
+def _render_in_worker(job: FigureJob) -> JobTiming:
+    return _render(job, _worker_data)
+
+def render_figures(jobs: list[FigureJob],
+                   data: Any = None,
+                   load_data: Optional[Callable] = None,
+                   max_workers: Optional[int] = None,
+) -> list[JobTiming]:
+    """
+    render figure jobs on a process pool with the Agg backend, one core per
+    worker by default. each worker holds the data once, either handed over
+    at start-up or loaded there by load_data(), e.g. a functools.partial
+    reading a file, which avoids pickling large inputs. the timings are
+    returned in the order of jobs; max_workers=1 renders in this process.
+    """
+    output_paths = [job.output_path for job in jobs if job.output_path is not None]
+    if len(set(output_paths)) != len(output_paths):
+        raise ValueError('figure jobs must have distinct output paths')
+
+    if max_workers == 1:
+        if load_data is not None:
+            data = load_data()
+        return [_render(job, data) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(data, load_data)) as executor:
+        return list(executor.map(_render_in_worker, jobs))
@@ -1,15 +1,28 @@
-import json
 import numpy as np
 import pandas as pd
-import uproot
 import mplhep as mh
 import matplotlib.pyplot as plt
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Union
 from matplotlib.colors import LogNorm
 from matplotlib.patches import Rectangle
 
-from NanoAODTnP.RPCGeometry.RPCGeomServ import get_segment, get_roll_name
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable, select_roll_names
+from NanoAODTnP.RPCGeometry.RPCGeomServ import AbsentSelectionError
+from NanoAODTnP.Analysis.Blacklist import load_roll_blacklist
+from NanoAODTnP.Analysis.TreeSchema import read_tree
+from NanoAODTnP.Plotting.FigurePool import FigureJob, render_figures
+
+ID_KEYS = ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']
+
+# binning of each hit variable and the lower cut dropping unmatched hits
+# (e.g. bx = -999); values below the range still count in mean and std
+HIST_PARAMS = {
+    'cls': {'bins': 11, 'range': (0, 11), 'cut': 0},
+    'bx': {'bins': 13, 'range': (-6, 7), 'cut': -100},
+    'residual_x': {'bins': 200, 'range': (-50, 50), 'cut': -300},
+}
 
 
 def load_filtered_tree(
@@ -27,28 +40,20 @@ def load_filtered_tree(
     ######################################################################################
     default_columns = ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll', 
                        'is_fiducial', 'is_matched']
-    data = uproot.open(f'{str(input_path)}:tree').arrays(columns + default_columns, library='np')
+    data = read_tree(input_path, columns + default_columns)
     
     fiducial_mask = data['is_fiducial']
     matched_mask = data['is_matched']
     for key, values in data.items():
         data[key] = data[key][fiducial_mask & matched_mask]
 
-    data['roll_name'] = np.array([
-        get_roll_name(
-            data['region'][idx], data['ring'][idx], data['station'][idx],
-            data['sector'][idx], data['layer'][idx], data['subsector'][idx], data['roll'][idx]
-        ) for idx in range(len(data['region']))
-    ])
+    ids = [data[key] for key in ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']]
+    roll_table = RollTable.from_ids(*ids)
+    roll_index = roll_table.get_roll_index(*ids)
+    data['roll_name'] = roll_table.get_roll_name(roll_index)
 
-    if roll_blacklist_path is None:
-        roll_blacklist = set()
-    else:
-        with open(roll_blacklist_path) as stream:
-            roll_blacklist = set(json.load(stream))
-    
-    is_blacklist = np.vectorize(lambda item: item in roll_blacklist)
-    blacklist_mask = is_blacklist(data['roll_name'])
+    roll_blacklist = load_roll_blacklist(roll_blacklist_path, roll_table)
+    blacklist_mask = ~roll_blacklist.get_mask(roll_index)
 
     for key, values in data.items():
         data[key] = data[key][~blacklist_mask]
@@ -71,25 +76,12 @@ def get_region_param(
     
     hatch = ['///', None]
 
-    if region is 'all':
-        is_region = np.vectorize(lambda item: type(item) is str)
+    # all, barrel, disk123, disk4, W-2, RE+1, ... or any RollSelector expression
+    is_region = lambda roll_name: select_roll_names(roll_name, region)
+    if region in facecolors:
         facecolor = facecolors[region]
         edgecolor = edgecolors[region]
-    elif region is 'barrel':
-        is_region = np.vectorize(lambda item: item.startswith('W'))
-        facecolor = facecolors[region]
-        edgecolor = edgecolors[region]
-    elif region is 'disk123':
-        is_region = np.vectorize(lambda item: item.startswith(('RE+1', 'RE+2', 'RE+3', 'RE-1', 'RE-2', 'RE-3')))
-        facecolor = facecolors[region]
-        edgecolor = edgecolors[region]
-    elif region is 'disk4':
-        is_region = np.vectorize(lambda item: item.startswith(('RE+4', 'RE-4')))
-        facecolor = facecolors[region]
-        edgecolor = edgecolors[region]
-    
-    is_region = np.vectorize(lambda item: item.startswith(region))
-    if region.startswith('W'):
+    elif region.startswith('W'):
         facecolor = facecolors['barrel']
         edgecolor = edgecolors['barrel']
     elif region.startswith(('RE+1', 'RE+2', 'RE+3', 'RE-1', 'RE-2', 'RE-3')):
@@ -109,10 +101,99 @@ def get_region_param(
     return region_param
 
 
+@dataclass
+class RegionHists:
+    """
+    histograms of a hit variable for every dataset and region with the mean
+    and std of the values passing the cut; counts[dataset, region, bin]
+    """
+    value: str
+    regions: list[str]
+    edges: np.ndarray
+    counts: np.ndarray
+    mean: np.ndarray
+    std: np.ndarray
+
+    def get(self, idx: int, region: str) -> tuple[np.ndarray, float, float]:
+        """
+        (counts, mean, std) of a dataset in a region
+        """
+        jdx = self.regions.index(region)
+        return self.counts[idx, jdx], self.mean[idx, jdx], self.std[idx, jdx]
+
+
+def select_present(roll_table: RollTable, region: str) -> np.ndarray:
+    """
+    RollTable.select on a table built from the hits of a dataset, where
+    regions without hits (e.g. RE4 once excluded) select no roll; typos and
+    invalid expressions still raise
+    """
+    try:
+        return roll_table.select(region)
+    except AbsentSelectionError:
+        return np.zeros(len(roll_table), dtype=bool)
+
+
+def fill_region_hists(
+    values: list[str],
+    data_list: list,
+    regions: list[str],
+) -> dict[str, RegionHists]:
+    """
+    fill the histograms of all values, datasets and regions in one pass over
+    the hits: hits are counted per (roll, bin) with np.bincount on a
+    combined index and regions sum their rolls with a (region, roll) matrix
+    """
+    n_data, n_region = len(data_list), len(regions)
+    edges = {}
+    counts, moments = {}, {}
+    for value in values:
+        param = HIST_PARAMS[value]
+        edges[value] = np.linspace(*param['range'], param['bins'] + 1)
+        counts[value] = np.zeros((n_data, n_region, param['bins']))
+        moments[value] = np.zeros((3, n_data, n_region))
+
+    for idx, data in enumerate(data_list):
+        ids = [data[key] for key in ID_KEYS]
+        roll_table = RollTable.from_ids(*ids)
+        roll_index = roll_table.get_roll_index(*ids)
+        n_roll = len(roll_table)
+        member = np.stack([select_present(roll_table, region) for region in regions]).astype(np.float64)
+
+        for value in values:
+            param = HIST_PARAMS[value]
+            n_bin = param['bins']
+            x = data[value].astype(np.float64)
+            keep = (x > param['cut']) & (roll_index >= 0)
+            x, index = x[keep], roll_index[keep]
+
+            # the last bin includes its upper edge like np.histogram
+            bin_index = np.searchsorted(edges[value], x, side='right') - 1
+            bin_index[x == edges[value][-1]] = n_bin - 1
+            in_range = (bin_index >= 0) & (bin_index < n_bin)
+            by_roll = np.bincount(index[in_range] * n_bin + bin_index[in_range],
+                                  minlength=n_roll * n_bin).reshape(n_roll, n_bin)
+            counts[value][idx] = member @ by_roll
+
+            for order in range(3):
+                by_roll = np.bincount(index, weights=x ** order, minlength=n_roll)
+                moments[value][order, idx] = member @ by_roll
+
+    region_hists = {}
+    for value in values:
+        n, total, total2 = moments[value]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            std = np.sqrt(np.maximum(total2 / n - mean ** 2, 0))
+        region_hists[value] = RegionHists(value, list(regions), edges[value],
+                                          counts[value], mean, std)
+    return region_hists
+
+
 def hist_cls(
     region: str,
     region_label: str,
-    data_list: list,
+    hists: RegionHists,
     data_label_list: list,
     label: str = 'Work in Progress',
     com: float = 13.6,
@@ -134,15 +215,10 @@ def hist_cls(
     extra = Rectangle((0, 0), 0.1, 0.1, fc='w', fill=False, edgecolor='none', linewidth=0)
     handle_patch_col, handle_label_col, handle_mean_col = [extra], [extra], [extra]
     value_patch_col, value_label_col, value_mean_col = [''], ['Data'], ['Mean']
-    for idx in range(len(data_list)):
-        region_mask = region_param['is_region'](data_list[idx]['roll_name'])
-        region_data = {}
-        for key, values in data_list[idx].items():
-            region_data[key] = data_list[idx][key][region_mask]
-
-        data = region_data['cls'][region_data['cls'] > 0]
+    for idx in range(len(data_label_list)):
+        region_count, mean, std = hists.get(idx, region)
         count, bins, patch = ax.hist(
-            data, bins = 11, range = (0, 11),
+            hists.edges[:-1], bins = hists.edges, weights = region_count,
             facecolor = region_param['facecolor'][idx],
             edgecolor = region_param['edgecolor'][idx],
             hatch = region_param['hatch'][idx],
@@ -159,7 +235,7 @@ def hist_cls(
         value_label_col.append(data_label_list[idx])
         
         handle_mean_col.append(extra)
-        value_mean_col.append(f'{np.mean(data) : .2f}')
+        value_mean_col.append(f'{mean : .2f}')
     
     legend_handle = handle_patch_col + handle_label_col + handle_mean_col
     legend_value = value_patch_col + value_label_col + value_mean_col
@@ -179,7 +255,7 @@ def hist_cls(
 def hist_bx(
     region: str,
     region_label: str,
-    data_list: list,
+    hists: RegionHists,
     data_label_list: list,
     label: str = 'Work in Progress',
     com: float = 13.6,
@@ -201,15 +277,10 @@ def hist_bx(
     extra = Rectangle((0, 0), 0.1, 0.1, fc='w', fill=False, edgecolor='none', linewidth=0)
     handle_patch_col, handle_label_col, handle_mean_col, handle_std_col = [extra], [extra], [extra], [extra]
     value_patch_col, value_label_col, value_mean_col, value_std_col = [''], ['Data'], ['Mean'], ['Std']
-    for idx in range(len(data_list)):
-        region_mask = region_param['is_region'](data_list[idx]['roll_name'])
-        region_data = {}
-        for key, values in data_list[idx].items():
-            region_data[key] = data_list[idx][key][region_mask]
-
-        data = region_data['bx'][region_data['bx'] > -100]
+    for idx in range(len(data_label_list)):
+        region_count, mean, std = hists.get(idx, region)
         count, bins, patch = ax.hist(
-            data, bins = 13, range = (-6, 7),
+            hists.edges[:-1], bins = hists.edges, weights = region_count,
             facecolor = region_param['facecolor'][idx],
             edgecolor = region_param['edgecolor'][idx],
             hatch = region_param['hatch'][idx],
@@ -226,10 +297,10 @@ def hist_bx(
         value_label_col.append(data_label_list[idx])
         
         handle_mean_col.append(extra)
-        value_mean_col.append(f'{np.mean(data) : .2f}')
+        value_mean_col.append(f'{mean : .2f}')
 
         handle_std_col.append(extra)
-        value_std_col.append(f'{np.std(data) : .2f}')
+        value_std_col.append(f'{std : .2f}')
     
     legend_handle = handle_patch_col + handle_label_col + handle_mean_col + handle_std_col
     legend_value = value_patch_col + value_label_col + value_mean_col + value_std_col
@@ -249,7 +320,7 @@ def hist_bx(
 def hist_residual_x(
     region: str,
     region_label: str,
-    data_list: list,
+    hists: RegionHists,
     data_label_list: list,
     label: str = 'Work in Progress',
     com: float = 13.6,
@@ -271,15 +342,10 @@ def hist_residual_x(
     extra = Rectangle((0, 0), 0.1, 0.1, fc='w', fill=False, edgecolor='none', linewidth=0)
     handle_patch_col, handle_label_col, handle_mean_col, handle_std_col = [extra], [extra], [extra], [extra]
     value_patch_col, value_label_col, value_mean_col, value_std_col = [''], ['Data'], ['Mean'], ['Std']
-    for idx in range(len(data_list)):
-        region_mask = region_param['is_region'](data_list[idx]['roll_name'])
-        region_data = {}
-        for key, values in data_list[idx].items():
-            region_data[key] = data_list[idx][key][region_mask]
-
-        data = region_data['residual_x'][region_data['residual_x'] > -300]
+    for idx in range(len(data_label_list)):
+        region_count, mean, std = hists.get(idx, region)
         count, bins, patch = ax.hist(
-            data, bins = 200, range = (-50, 50),
+            hists.edges[:-1], bins = hists.edges, weights = region_count,
             facecolor = region_param['facecolor'][idx],
             edgecolor = region_param['edgecolor'][idx],
             hatch = region_param['hatch'][idx],
@@ -296,10 +362,10 @@ def hist_residual_x(
         value_label_col.append(data_label_list[idx])
         
         handle_mean_col.append(extra)
-        value_mean_col.append(f'{np.mean(data) : .2f}')
+        value_mean_col.append(f'{mean : .2f}')
     
         handle_std_col.append(extra)
-        value_std_col.append(f'{np.std(data) : .2f}')
+        value_std_col.append(f'{std : .2f}')
     
     legend_handle = handle_patch_col + handle_label_col + handle_mean_col + handle_std_col
     legend_value = value_patch_col + value_label_col + value_mean_col + value_std_col
@@ -316,8 +382,16 @@ def hist_residual_x(
     fig.savefig(output_dir / f'hist1d-residual_x-{region}.png')
 
 
+def render_region_hist(region_hists: dict[str, RegionHists], value: str, **kwargs):
+    """
+    figure job of hist_by_hit, region_hists is the data of the pool
+    """
+    hist_funcs = {'bx': hist_bx, 'cls': hist_cls, 'residual_x': hist_residual_x}
+    hist_funcs[value](hists=region_hists[value], **kwargs)
+
+
 def hist_by_hit(
-    value: str, # 'bx', 'cls', 'residual_x'
+    value: Union[str, list[str]], # 'bx', 'cls', 'residual_x' or a list of them
     data_path_list: list[Path],
     data_label_list: list[str],
     roll_blacklist_path_list: list[Path],
@@ -325,13 +399,16 @@ def hist_by_hit(
     com: float,
     log_scale: bool = False,
     output_dir: Path = Path.cwd(),
+    max_workers: Optional[int] = 1,
 ):
+    # max_workers: number of rendering processes, None for all cores
+    values = [value] if type(value) is str else list(value)
     data_list = []
     for idx in range(len(data_path_list)):
         data = load_filtered_tree(
             input_path = data_path_list[idx],
             roll_blacklist_path = roll_blacklist_path_list[idx],
-            columns = [value]
+            columns = values
         )
         data_list.append(data)
 
@@ -345,38 +422,25 @@ def hist_by_hit(
                      'RE+1', 'RE+2', 'RE+3', 'RE+4',
                      'RE-1', 'RE-2', 'RE-3', 'RE-4',]
 
-    for idx in range(len(regions)):
-        if value == 'bx':
-            hist_bx(
-                region = regions[idx],
-                region_label = region_labels[idx],
-                data_list = data_list,
-                data_label_list = data_label_list,
-                label = label,
-                com = com,
-                log_scale = log_scale,
-                output_dir = output_dir,
-            )
-        elif value == 'cls':
-            hist_cls(
-                region = regions[idx],
-                region_label = region_labels[idx],
-                data_list = data_list,
-                data_label_list = data_label_list,
-                label = label,
-                com = com,
-                log_scale = log_scale,
-                output_dir = output_dir,
-            )
-        elif value == 'residual_x':
-            hist_residual_x(
-                region = regions[idx],
-                region_label = region_labels[idx],
-                data_list = data_list,
-                data_label_list = data_label_list,
-                label = label,
-                com = com,
-                log_scale = log_scale,
-                output_dir = output_dir,
-            )
-        
\ No newline at end of file
+    region_hists = fill_region_hists(values, data_list, regions)
+    if not output_dir.exists():
+        output_dir.mkdir(parents=True)
+
+    jobs = []
+    for value in values:
+        for idx in range(len(regions)):
+            jobs.append(FigureJob(
+                func = render_region_hist,
+                kwargs = dict(
+                    value = value,
+                    region = regions[idx],
+                    region_label = region_labels[idx],
+                    data_label_list = data_label_list,
+                    label = label,
+                    com = com,
+                    log_scale = log_scale,
+                    output_dir = output_dir,
+                ),
+                output_path = output_dir / f'hist1d-{value}-{regions[idx]}.png',
+            ))
+    return render_figures(jobs, data=region_hists, max_workers=max_workers)
@@ -1,104 +1,32 @@
 from typing import Optional, Union
-from collections import defaultdict
 from pathlib import Path
 from typing import Optional, Union
-import json
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
 import uproot
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.colors import Colormap, ListedColormap
-from matplotlib.patches import Polygon
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PolyCollection
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import mplhep as mh
 
-from NanoAODTnP.RPCGeometry.RPCGeomServ import RPCRoll
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable
+from NanoAODTnP.RPCGeometry.RPCGeomPlot import get_polygon_labels
+from NanoAODTnP.Analysis.Blacklist import Blacklist
+from NanoAODTnP.Analysis.RollRunCount import RollRunCount
+from NanoAODTnP.Plotting.FigurePool import FigureJob, render_figures
 
 
-def plot_patches(patches: list[Polygon],
-                 values: npt.NDArray[np.float32],
-                 #mask: Optional[npt.NDArray[np.bool_]] = None,
-                 zero_mask: Optional[npt.NDArray[np.bool_]] = None,
-                 excluded_mask: Optional[npt.NDArray[np.bool_]] = None,
-                 cmap: Union[Colormap, str] = 'magma',
-                 edgecolor: str = 'black',                 
-                 ax: Optional[plt.Axes] = None,
-                 vmin: Optional[Union[float, np.float32]] = None,
-                 vmax: Optional[Union[float, np.float32]] = None,
-                 lw: float = 1.5,
-) -> plt.Figure:
-    """
-    """
-    ax = ax or plt.gca()
-    if vmin is None:
-        vmin = np.nanmin(values)
-    if vmax is None:
-        vmax = np.nanmax(values)
-    
-    cmap = plt.get_cmap(cmap)
-    normalized_values = (values - vmin) / (vmax - vmin)
-    color = cmap(normalized_values)
-    
-    if zero_mask is not None:
-        color[zero_mask] = np.nan
-    if excluded_mask is not None:
-        color[excluded_mask] = np.nan
-
-    collection = PatchCollection(patches)
-    collection.set_color(color)
-    collection.set_edgecolor(edgecolor)
-    collection.set_linewidth(lw)
-    ax.add_collection(collection)
-
-    excluded_patches = []
-    for idx in range(len(patches)):
-        if excluded_mask[idx] == True:
-            excluded_patches.append(patches[idx])
-    excluded_collection = PatchCollection(excluded_patches)
-    excluded_collection.set_color(np.array([0, 0, 0, 0.8]))
-    excluded_collection.set_edgecolor(edgecolor)
-    excluded_collection.set_linewidth(lw)
-    excluded_collection.set_hatch('///')
-    ax.add_collection(excluded_collection)
-
-    # add colobar
-    ax.autoscale_view()
-    scalar_mappable = plt.cm.ScalarMappable(
-        cmap=cmap,
-        norm=plt.Normalize(vmin=vmin, vmax=vmax) # FIXME
-    )
-    scalar_mappable.set_array([])
-    axes_divider = make_axes_locatable(ax)
-    cax = axes_divider.append_axes("right", size="5%", pad=0.2)
-    cax.figure.colorbar(scalar_mappable, cax=cax, pad=0.1)
-
-    return ax.figure
-
-
-def plot_detector_unit(h_total,
-                       h_passed,
-                       detector_unit: str,
-                       roll_list: list[RPCRoll],
-                       value: str,
-                       percentage: bool,
-                       label: str,
-                       year: Union[int, str],
-                       lumi: Optional[float],
-                       com: float,
-                       output_path: Optional[Path],
-                       close: bool,
-):
+def get_value_style(total: npt.NDArray[np.float64],
+                    passed: npt.NDArray[np.float64],
+                    value: str,
+                    percentage: bool,
+) -> tuple[npt.NDArray[np.float64], str, Union[Colormap, str], float, float]:
     """
-    plot eff, denom, numer
+    (values, label, cmap, vmin, vmax) of eff, denom or numer
     """
-    mh.style.use(mh.styles.CMS)
-    name_list = [each.id.name for each in roll_list]
-    patches = [each.polygon for each in roll_list]
-
-    total = h_total[name_list].values()
-    passed = h_passed[name_list].values()
     if value == "efficiency":
         eff = np.divide(passed, total, out=np.zeros_like(total),
                         where=(total > 0))
@@ -112,67 +40,192 @@ def plot_detector_unit(h_total,
         ])
         vmin = 0
         vmax = 100 if percentage else 1
-    
+
     elif value == "denominator":
         values = total
         values_label = 'Denominator'
         cmap = 'YlOrRd'
         vmin = 0
         vmax = np.max(total)
-    
+
     elif value == "numerator":
         values = passed
         values_label = 'Numerator'
         cmap = 'YlGnBu'
         vmin = 0
         vmax = np.max(passed)
-    
-    zero_mask = (values < 1e-4)
-    excluded_mask = (total < 1e-4)
-    fig, ax = plt.subplots(figsize = (12, 10))
-    fig = plot_patches(
-        patches=patches,
-        values=values,
-        zero_mask=zero_mask,
-        excluded_mask=excluded_mask,
-        vmin=vmin,
-        vmax=vmax,
-        ax=ax,
-        cmap=cmap
-    )
-    _, cax = fig.get_axes()
-
-    xlabel = roll_list[0].polygon_xlabel
-    ylabel = roll_list[0].polygon_ylabel
-    ymax = roll_list[0].polygon_ymax
-
-    ax.set_xlabel(xlabel, fontsize=24) # type: ignore
-    ax.set_ylabel(ylabel, fontsize=24) # type: ignore
-    
-    cax.set_ylim(vmin, vmax)
-    ax.set_ylim(None, ymax) # type: ignore
-    ax.annotate(detector_unit, (0.05, 0.920), weight='bold',
-                xycoords='axes fraction', fontsize=24) # type: ignore
-    ax.annotate(values_label, (0.97, 0.920), weight='bold',
-                xycoords='axes fraction', fontsize=24, horizontalalignment='right') # type: ignore
-    mh.cms.label(ax=ax, llabel=label, com=com, year=year, fontsize=24, lumi=lumi)
-
-    ax.hist([], facecolor=np.array([0, 0, 0, 0.8]), edgecolor='black', hatch='///', label=f': Excluded')
-    #ax.hist([], facecolor='white', edgecolor='black', label=f': {values_label[:3] if value == 'efficiency' else values_label[:5]}=0')
-    if detector_unit.startswith('RE'):
-        ax.legend(handlelength=1.4, handleheight=1.2,
-                  alignment='right', loc='lower right', 
-                  handletextpad = 0.2,
-                  prop={'weight':'bold', 'size': 24})
-    else:
-        ax.legend(handlelength=1.4, handleheight=1.2,
-                  alignment='right', loc='upper center', 
-                  handletextpad = 0.2,
-                  prop={'weight':'bold', 'size': 24})
-
-    if output_path is not None:
-        for suffix in ['.png']:
-            fig.savefig(output_path.with_suffix(suffix))
+
+    return values, values_label, cmap, vmin, vmax
+
+
+class DetectorUnitMap:
+    """
+    figure template of a detector unit: the patches, the excluded patches,
+    the colorbar and the labels are built once, and draw only swaps the
+    face colors, the excluded patches, the color scale and the value label
+    """
+
+    def __init__(self,
+                 detector_unit: str,
+                 patches: npt.NDArray[np.float64],
+                 label: str,
+                 year: Union[int, str],
+                 lumi: Optional[float],
+                 com: float,
+                 use_pyplot: bool = True,
+                 edgecolor: str = 'black',
+                 lw: float = 1.5,
+    ):
+        # figures outside pyplot are neither shown nor closed by plt.close
+        mh.style.use(mh.styles.CMS)
+        if use_pyplot:
+            fig, ax = plt.subplots(figsize = (12, 10))
+        else:
+            fig = Figure(figsize = (12, 10))
+            ax = fig.subplots()
+        self.fig, self.ax = fig, ax
+        self.patches = patches
+
+        self.collection = PolyCollection(patches)
+        self.collection.set_edgecolor(edgecolor)
+        self.collection.set_linewidth(lw)
+        ax.add_collection(self.collection)
+
+        self.excluded_collection = PolyCollection(patches[:0])
+        self.excluded_collection.set_color(np.array([0, 0, 0, 0.8]))
+        self.excluded_collection.set_edgecolor(edgecolor)
+        self.excluded_collection.set_linewidth(lw)
+        self.excluded_collection.set_hatch('///')
+        ax.add_collection(self.excluded_collection)
+
+        # add colobar
+        ax.autoscale_view()
+        self.scalar_mappable = plt.cm.ScalarMappable(norm=plt.Normalize(vmin=0, vmax=1))
+        self.scalar_mappable.set_array([])
+        axes_divider = make_axes_locatable(ax)
+        self.cax = axes_divider.append_axes("right", size="5%", pad=0.2)
+        self.colorbar = fig.colorbar(self.scalar_mappable, cax=self.cax, pad=0.1)
+
+        xlabel, ylabel, ymax = get_polygon_labels(detector_unit.startswith('RB'))
+
+        ax.set_xlabel(xlabel, fontsize=24) # type: ignore
+        ax.set_ylabel(ylabel, fontsize=24) # type: ignore
+
+        ax.set_ylim(None, ymax) # type: ignore
+        ax.annotate(detector_unit, (0.05, 0.920), weight='bold',
+                    xycoords='axes fraction', fontsize=24) # type: ignore
+        self.values_annotation = ax.annotate(
+            '', (0.97, 0.920), weight='bold', xycoords='axes fraction',
+            fontsize=24, horizontalalignment='right') # type: ignore
+        mh.cms.label(ax=ax, llabel=label, com=com, year=year, fontsize=24, lumi=lumi)
+
+        ax.hist([], facecolor=np.array([0, 0, 0, 0.8]), edgecolor='black', hatch='///', label=f': Excluded')
+        #ax.hist([], facecolor='white', edgecolor='black', label=f': {values_label[:3] if value == 'efficiency' else values_label[:5]}=0')
+        if detector_unit.startswith('RE'):
+            ax.legend(handlelength=1.4, handleheight=1.2,
+                      alignment='right', loc='lower right',
+                      handletextpad = 0.2,
+                      prop={'weight':'bold', 'size': 24})
+        else:
+            ax.legend(handlelength=1.4, handleheight=1.2,
+                      alignment='right', loc='upper center',
+                      handletextpad = 0.2,
+                      prop={'weight':'bold', 'size': 24})
+
+    def draw(self,
+             total: npt.NDArray[np.float64],
+             passed: npt.NDArray[np.float64],
+             value: str,
+             percentage: bool,
+             output_path: Optional[Path] = None,
+    ) -> Figure:
+        """
+        total and passed are aligned with the patches of the template
+        """
+        values, values_label, cmap, vmin, vmax = get_value_style(
+            total, passed, value, percentage)
+        zero_mask = (values < 1e-4)
+        excluded_mask = (total < 1e-4)
+
+        cmap = plt.get_cmap(cmap)
+        color = cmap((values - vmin) / (vmax - vmin))
+        color[zero_mask] = np.nan
+        color[excluded_mask] = np.nan
+        self.collection.set_facecolor(color)
+        self.excluded_collection.set_verts(self.patches[excluded_mask])
+
+        self.scalar_mappable.set_cmap(cmap)
+        self.scalar_mappable.set_norm(plt.Normalize(vmin=vmin, vmax=vmax))
+        self.cax.set_ylim(vmin, vmax)
+        self.values_annotation.set_text(values_label)
+
+        if output_path is not None:
+            for suffix in ['.png']:
+                self.fig.savefig(output_path.with_suffix(suffix))
+        return self.fig
+
+
+class DetectorMapRenderer:
+    """
+    keeps a DetectorUnitMap per detector unit, rolls and labels, so that
+    maps of the same unit for other values, runs or blacklist variants only
+    recolor an existing figure; templates live outside pyplot
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def get_template(self,
+                     detector_unit: str,
+                     patches: npt.NDArray[np.float64],
+                     label: str,
+                     year: Union[int, str],
+                     lumi: Optional[float],
+                     com: float,
+    ) -> DetectorUnitMap:
+        key = (detector_unit, patches.tobytes(), label, year, lumi, com)
+        if key not in self.templates:
+            self.templates[key] = DetectorUnitMap(
+                detector_unit, patches, label=label, year=year, lumi=lumi,
+                com=com, use_pyplot=False)
+        return self.templates[key]
+
+    def draw(self,
+             total: npt.NDArray[np.float64],
+             passed: npt.NDArray[np.float64],
+             detector_unit: str,
+             patches: npt.NDArray[np.float64],
+             value: str,
+             percentage: bool,
+             label: str,
+             year: Union[int, str],
+             lumi: Optional[float],
+             com: float,
+             output_path: Optional[Path] = None,
+    ) -> Figure:
+        template = self.get_template(detector_unit, patches, label, year, lumi, com)
+        return template.draw(total, passed, value, percentage, output_path)
+
+
+def plot_detector_unit(total: npt.NDArray[np.float64],
+                       passed: npt.NDArray[np.float64],
+                       detector_unit: str,
+                       patches: npt.NDArray[np.float64],
+                       value: str,
+                       percentage: bool,
+                       label: str,
+                       year: Union[int, str],
+                       lumi: Optional[float],
+                       com: float,
+                       output_path: Optional[Path],
+                       close: bool,
+):
+    """
+    plot eff, denom, numer; total and passed are aligned with patches
+    """
+    unit_map = DetectorUnitMap(detector_unit, patches, label=label, year=year,
+                               lumi=lumi, com=com)
+    fig = unit_map.draw(total, passed, value, percentage, output_path)
 
     if close:
         plt.close(fig)
@@ -190,44 +243,57 @@ def plot_detector_map(input_path: Path,
                       year: Optional[Union[int, str]] = None,
                       percentage: bool = True,
                       roll_blacklist_path: Optional[Path] = None,
+                      run_blacklist_path: Optional[Path] = None,
+                      exclude_RE4: bool = False,
+                      max_workers: Optional[int] = 1,
+                      renderer: Optional[DetectorMapRenderer] = None,
 ):
-    input_file = uproot.open(input_path)
+    # max_workers: number of rendering processes, None for all cores
+    # renderer: reuse its figure templates across calls, e.g. for every
+    # value, run or blacklist variant of the same geometry; only with
+    # max_workers=1, since a pool would build the templates in its workers
+    # and drop them when it exits
+    # blacklisted rolls are not drawn, excluded runs and RE4 are masked here
+    if renderer is not None and max_workers != 1:
+        raise ValueError('a renderer only keeps its templates with max_workers=1')
+    count = RollRunCount.from_root(
+        input_path, by_run=run_blacklist_path is not None).apply_blacklist(
+        run_blacklist_path=run_blacklist_path, exclude_RE4=exclude_RE4)
+    count_index = pd.Index(count.roll_name)
 
-    if roll_blacklist_path is None:
-        roll_blacklist = set()
-    else:
-        with open(roll_blacklist_path) as stream:
-            roll_blacklist = set(json.load(stream))
-
-    h_total: Hist = input_file['total_by_roll'].to_hist() # type: ignore
-    h_passed: Hist = input_file['passed_by_roll'].to_hist() # type: ignore
-
-    geom = pd.read_csv(geom_path)
-    roll_list = [RPCRoll.from_row(row)
-                 for _, row in geom.iterrows()
-                 if row.roll_name not in roll_blacklist]
+    roll_table = RollTable.load(geom_path)
+    roll_mask = Blacklist.from_json(roll_blacklist_path).get_mask(roll_table.roll_name)
 
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
     # wheel (or disk) to rolls
-    unit_to_rolls = defaultdict(list)
-    for roll in roll_list:
-        unit_to_rolls[roll.id.detector_unit].append(roll)
+    unit_to_index = roll_table.get_unit_indices(roll_mask)
+
+    if renderer is None:
+        renderer = DetectorMapRenderer()
 
-    for detector_unit, roll_list in unit_to_rolls.items():
+    jobs = []
+    for detector_unit, roll_index in unit_to_index.items():
         output_path = output_dir / detector_unit
-        plot_detector_unit(
-            h_total,
-            h_passed,
-            detector_unit=detector_unit,
-            roll_list=roll_list,
-            value=value,
-            percentage=percentage,
-            label=label,
-            year=year,
-            lumi=lumi,
-            com=com,
-            output_path=output_path,
-            close=True
-        )
+        index = count_index.get_indexer(roll_table.roll_name[roll_index])
+        # rolls missing from the file have no hits and are drawn as excluded
+        missing = index < 0
+        jobs.append(FigureJob(
+            func=DetectorMapRenderer.draw,
+            kwargs=dict(
+                total=np.where(missing, 0, count.total_by_roll[index]),
+                passed=np.where(missing, 0, count.passed_by_roll[index]),
+                detector_unit=detector_unit,
+                patches=roll_table.get_polygons(roll_index),
+                value=value,
+                percentage=percentage,
+                label=label,
+                year=year,
+                lumi=lumi,
+                com=com,
+                output_path=output_path,
+            ),
+            output_path=output_path.with_suffix('.png'),
+        ))
+    return render_figures(jobs, data=renderer, max_workers=max_workers)
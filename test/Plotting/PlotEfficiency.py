@@ -16,6 +16,12 @@ import matplotlib.dates as mdates
 from matplotlib.colors import LogNorm
 from matplotlib.patches import Rectangle
 
+from NanoAODTnP.RPCGeometry.RPCGeomServ import select_roll_names
+from NanoAODTnP.Analysis.Blacklist import Blacklist, IRPC_ROLLS
+from NanoAODTnP.Analysis.RollRunCount import RollRunCount
+from NanoAODTnP.Analysis.LumiBlockChecker import LumiBlockChecker
+from NanoAODTnP.Analysis.LumiIndex import LumiIndex
+
 def init_figure(
     figsize: tuple = (8, 6),
     fontsize: float = 20,
@@ -66,30 +72,26 @@ def get_region_params(region: str) -> dict:
                        'Disk1,2,3': ['#000775', '#000775'],
                        'Disk4': ['#CC0000', '#CC0000']}
     hatches = ['///', None]
-    is_region = np.vectorize(lambda item: item.startswith(region))
+    # All, Barrel, Endcap, Disk4, W-2, RE+1, ... or any RollSelector expression
+    is_region = lambda roll_name: select_roll_names(roll_name, region)
     facecolors = facecolor_table['All']
     edgecolors = edgecolor_table['All']
     
     if region == 'All':
         facecolors = facecolor_table[region]
         edgecolors = edgecolor_table[region]
-        is_region = np.vectorize(lambda item: type(item) is str)
     elif region == 'Barrel':
         facecolors = facecolor_table[region]
         edgecolors = edgecolor_table[region]
-        is_region = np.vectorize(lambda item: item.startswith('W'))
     elif region == 'Endcap':
         facecolors = facecolor_table['Disk1,2,3']
         edgecolors = edgecolor_table['Disk1,2,3']
-        is_region = np.vectorize(lambda item: item.startswith('RE'))
     elif region == 'Disk1,2,3':
         facecolors = facecolor_table[region]
         edgecolors = edgecolor_table[region]
-        is_region = np.vectorize(lambda item: item.startswith(('RE+1', 'RE+2', 'RE+3', 'RE-1', 'RE-2', 'RE-3')))
     elif region == 'Disk4':
         facecolors = facecolor_table[region]
         edgecolors = edgecolor_table[region]
-        is_region = np.vectorize(lambda item: item.startswith(('RE+4', 'RE-4')))
     elif region.startswith('W'):
         facecolors = facecolor_table['Barrel']
         edgecolors = edgecolor_table['Barrel']
@@ -107,29 +109,36 @@ def get_region_params(region: str) -> dict:
         'hatches': hatches
     }
 
-def hist_eff_by_roll(input_path_1, input_path_2, region, output_path):
-    total_by_roll_1 = uproot.open(f'{input_path_1}:total_by_roll').to_hist()
-    passed_by_roll_1 = uproot.open(f'{input_path_1}:passed_by_roll').to_hist()
-
-    total_by_roll_2 = uproot.open(f'{input_path_2}:total_by_roll').to_hist()
-    passed_by_roll_2 = uproot.open(f'{input_path_2}:passed_by_roll').to_hist()
-
-    total_1 = total_by_roll_1.values()
-    passed_1 = passed_by_roll_1.values()
-    roll_name_1 = np.array(total_by_roll_1.axes[0])
-
-    total_2 = total_by_roll_2.values()
-    passed_2 = passed_by_roll_2.values()
-    roll_name_2 = np.array(total_by_roll_2.axes[0])
+def hist_eff_by_roll(input_path_1, input_path_2, region, output_path,
+                     roll_blacklist_path_1=None,
+                     roll_blacklist_path_2=None,
+                     run_blacklist_path=None,
+                     exclude_RE4=False):
+    count_1 = RollRunCount.from_root(
+        input_path_1, by_run=run_blacklist_path is not None).apply_blacklist(
+        roll_blacklist_path_1, run_blacklist_path, exclude_RE4)
+    count_2 = RollRunCount.from_root(
+        input_path_2, by_run=run_blacklist_path is not None).apply_blacklist(
+        roll_blacklist_path_2, run_blacklist_path, exclude_RE4)
+
+    total_1 = count_1.total_by_roll
+    passed_1 = count_1.passed_by_roll
+    roll_name_1 = count_1.roll_name
+
+    total_2 = count_2.total_by_roll
+    passed_2 = count_2.passed_by_roll
+    roll_name_2 = count_2.roll_name
 
     region_params = get_region_params(region)
-    is_iRPC = np.vectorize(lambda roll: roll in {"RE+4_R1_CH15_A", "RE+4_R1_CH16_A", "RE+3_R1_CH15_A", "RE+3_R1_CH16_A"})
+    irpc_blacklist = Blacklist(IRPC_ROLLS)
+    mask_1 = count_1.roll_table.select(region) & irpc_blacklist.get_mask(roll_name_1)
+    mask_2 = count_2.roll_table.select(region) & irpc_blacklist.get_mask(roll_name_2)
 
-    total_1 = total_1[region_params['is_region'](roll_name_1) & ~is_iRPC(roll_name_1)]
-    passed_1 = passed_1[region_params['is_region'](roll_name_1) & ~is_iRPC(roll_name_1)]
+    total_1 = total_1[mask_1]
+    passed_1 = passed_1[mask_1]
     
-    total_2 = total_2[region_params['is_region'](roll_name_2) & ~is_iRPC(roll_name_2)]
-    passed_2 = passed_2[region_params['is_region'](roll_name_2) & ~is_iRPC(roll_name_2)]
+    total_2 = total_2[mask_2]
+    passed_2 = passed_2[mask_2]
 
     eff_1 = np.divide(passed_1, total_1,
                       out = np.zeros_like(total_1),
@@ -258,19 +267,21 @@ def time_average(dates):
   any_reference_date = datetime(1900, 1, 1)
   return any_reference_date + sum([date - any_reference_date for date in dates], timedelta()) / len(dates)
 
-def plot_eff_time(ax, input_path, run_info, region, fix_color=True, alpha=1.0):
-    total_by_roll_run = uproot.open(f'{input_path}:total_by_roll_run').to_hist()
-    passed_by_roll_run = uproot.open(f'{input_path}:passed_by_roll_run').to_hist()
+def plot_eff_time(ax, input_path, run_info, region, fix_color=True, alpha=1.0,
+                  roll_blacklist_path=None, run_blacklist_path=None, exclude_RE4=False):
+    count = RollRunCount.from_root(input_path).apply_blacklist(
+        roll_blacklist_path, run_blacklist_path, exclude_RE4)
 
-    total = total_by_roll_run.values()
-    passed = passed_by_roll_run.values()
+    total = count.total
+    passed = count.passed
 
-    roll_name = np.array(total_by_roll_run.axes[0])
-    runs = np.array(total_by_roll_run.axes[1])
+    roll_name = count.roll_name
+    runs = count.run
 
     region_params = get_region_params(region)
-    total = np.sum(total[region_params['is_region'](roll_name)], axis=0)
-    passed = np.sum(passed[region_params['is_region'](roll_name)], axis=0)
+    region_mask = count.roll_table.select(region)
+    total = np.sum(total[region_mask], axis=0)
+    passed = np.sum(passed[region_mask], axis=0)
 
     runs_mask = (total != 0)
 
@@ -305,6 +316,19 @@ def plot_eff_time(ax, input_path, run_info, region, fix_color=True, alpha=1.0):
     )
     return ax, effs, runs
 
+def get_recorded_lumi(input_path, lumi_path, cert_path=None,
+                      run_blacklist_path=None):
+    """
+    recorded luminosity [/fb] of the runs with hits in input_path, certified
+    by cert_path if given; lumi_path is brilcalc --byrun output (one or a
+    list of csv files)
+    """
+    count = RollRunCount.from_root(input_path).apply_blacklist(
+        run_blacklist_path=run_blacklist_path)
+    runs = count.run[count.total_by_run > 0]
+    checker = None if cert_path is None else LumiBlockChecker.from_json(cert_path)
+    return LumiIndex.from_brilcalc(lumi_path).get_recorded_lumi(checker, runs=runs)
+
 def plot_eff_by_time_run3(input_path, 
                           run_info_path, 
                           region,
@@ -312,7 +336,17 @@ def plot_eff_by_time_run3(input_path,
                           era='Run3',
                           lumi=69.4,
                           fix_color=True,
-                          alpha=1.0):
+                          alpha=1.0,
+                          roll_blacklist_path=None,
+                          run_blacklist_path=None,
+                          exclude_RE4=False,
+                          lumi_path=None,
+                          cert_path=None):
+    # lumi_path (brilcalc --byrun csv) replaces the fixed lumi label
+    if lumi_path is not None:
+        lumi = get_recorded_lumi(input_path, lumi_path, cert_path,
+                                 run_blacklist_path)
+
     if type(region) is list:
         mid_label = 'RPC Efficiency'
     elif type(region) is str:
@@ -407,11 +441,13 @@ def plot_eff_by_time_run3(input_path,
 
     if type(region) is list:
         for i_region in region:
-            ax, effs, runs = plot_eff_time(ax, input_path, run_info, i_region, fix_color, alpha)      
+            ax, effs, runs = plot_eff_time(ax, input_path, run_info, i_region, fix_color, alpha,
+                                          roll_blacklist_path, run_blacklist_path, exclude_RE4)      
         #ax.legend(loc='center right', fontsize = 28)
         ax.legend(fontsize=28, loc='lower center') if era == 'Run3' else ax.legend(fontsize=28)
     elif type(region) is str:
-        ax, effs, runs = plot_eff_time(ax, input_path, run_info, region, fix_color, alpha)
+        ax, effs, runs = plot_eff_time(ax, input_path, run_info, region, fix_color, alpha,
+                                      roll_blacklist_path, run_blacklist_path, exclude_RE4)
     
     ax.grid()
 
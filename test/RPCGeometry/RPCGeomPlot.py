@@ -0,0 +1,21 @@
+from typing import Optional
+import numpy as np
+import numpy.typing as npt
+from matplotlib.patches import Polygon
+
+
+def get_polygon_labels(barrel: bool) -> tuple[str, str, Optional[float]]:
+    """
+    xlabel, ylabel and ymax of the roll polygons of a detector unit
+    """
+    if barrel:
+        return r'$z$ [cm]', r'$\phi$ [radian]', 7
+    else:
+        return r'$x$ [cm]', r'$y$ [cm]', None
+
+
+def make_polygon(xy: npt.NDArray[np.float64]) -> Polygon:
+    """
+    closed patch of (4, 2) roll vertices, e.g. RollTable.get_polygons
+    """
+    return Polygon(xy, closed=True)
@@ -1,10 +1,22 @@
+import re
+from pathlib import Path
 from dataclasses import dataclass, asdict
 from functools import cache
 from functools import cached_property
+from typing import Optional, TYPE_CHECKING
 import numpy as np
 import numpy.typing as npt
-import pandas as pd
-from matplotlib.patches import Polygon
+
+from NanoAODTnP.Cache import get_cache_path, write_cache
+
+# pandas is only needed to parse csv files and roll names and matplotlib
+# only to draw, so both are imported on first use to keep flatten jobs light
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.patches import Polygon
+
+# bump when the snapshot layout of RollTable.load changes
+GEOMETRY_SNAPSHOT_VERSION = 1
 
 
 @cache
@@ -56,6 +68,746 @@ def get_detector_unit(region: int, station: int, layer: int) -> str:
     return detector_unit
 
 
+ID_KEYS = ['region', 'ring', 'station', 'sector', 'layer', 'subsector', 'roll']
+
+
+def get_det_id(region: npt.ArrayLike, ring: npt.ArrayLike, station: npt.ArrayLike,
+               sector: npt.ArrayLike, layer: npt.ArrayLike,
+               subsector: npt.ArrayLike, roll: npt.ArrayLike
+) -> npt.NDArray[np.uint32]:
+    """
+    vectorized raw id of RPCDetId
+    https://github.com/cms-sw/cmssw/blob/CMSSW_13_3_0_pre3/DataFormats/MuonDetId/src/RPCDetId.cc
+    """
+    region, ring, station, sector, layer, subsector, roll = [
+        np.asarray(each, dtype=np.int64)
+        for each in (region, ring, station, sector, layer, subsector, roll)
+    ]
+    # barrel wheels -2..2 are stored after the endcap rings 1..3
+    ring = np.where(region == 0, ring + 5, ring - 1)
+    det_id = ((2 << 28) | (3 << 25) # DetId::Muon, MuonSubdetId::RPC
+              | (region + 1)
+              | (ring << 2)
+              | ((station - 1) << 5)
+              | ((sector - 1) << 7)
+              | ((layer - 1) << 11)
+              | ((subsector - 1) << 12)
+              | (roll << 15))
+    # ids that do not fit into their bit fields get 0, i.e. no roll
+    valid = ((np.abs(region) <= 1) & (ring >= 0) & (ring < 8)
+             & (station >= 1) & (station <= 4) & (sector >= 1) & (sector <= 16)
+             & (layer >= 1) & (layer <= 2) & (subsector >= 1) & (subsector <= 8)
+             & (roll >= 0) & (roll < 8))
+    return np.where(valid, det_id, 0).astype(np.uint32)
+
+
+def decode_det_id(det_id: npt.ArrayLike) -> dict[str, npt.NDArray[np.int64]]:
+    """
+    inverse of get_det_id
+    """
+    det_id = np.asarray(det_id, dtype=np.int64)
+    region = (det_id & 0x3) - 1
+    ring = (det_id >> 2) & 0x7
+    return {
+        'region': region,
+        'ring': np.where(region == 0, ring - 5, ring + 1),
+        'station': ((det_id >> 5) & 0x3) + 1,
+        'sector': ((det_id >> 7) & 0xF) + 1,
+        'layer': ((det_id >> 11) & 0x1) + 1,
+        'subsector': ((det_id >> 12) & 0x7) + 1,
+        'roll': (det_id >> 15) & 0x7,
+    }
+
+
+BARREL_NAME_PATTERN = (r'^W(?P<ring>[+-]\d)_RB(?P<station>\d)(?P<suffix>in|out|\+\+|--|\+|-)?'
+                       r'_S(?P<sector>\d\d)_(?P<roll>Backward|Middle|Forward)$')
+ENDCAP_NAME_PATTERN = (r'^RE(?P<sign>[+-])(?P<station>\d)_R(?P<ring>\d)'
+                       r'_CH(?P<segment>\d\d)_(?P<roll>[A-E])$')
+
+
+def decode_roll_name(roll_name: npt.ArrayLike) -> dict[str, npt.NDArray[np.int64]]:
+    """
+    inverse of get_roll_name for arrays of names; ids of unknown names are 0
+    """
+    import pandas as pd
+    roll_name = pd.Series(np.asarray(roll_name, dtype=str))
+    barrel = roll_name.str.extract(BARREL_NAME_PATTERN)
+    endcap = roll_name.str.extract(ENDCAP_NAME_PATTERN)
+    is_barrel = barrel['ring'].notna().to_numpy()
+    is_endcap = endcap['ring'].notna().to_numpy()
+
+    def to_int(column: 'pd.Series') -> npt.NDArray[np.int64]:
+        return pd.to_numeric(column, errors='coerce').fillna(0).to_numpy(np.int64)
+
+    # barrel
+    b_station = to_int(barrel['station'])
+    b_sector = to_int(barrel['sector'])
+    suffix = barrel['suffix'].fillna('').to_numpy(str)
+    b_layer = np.where(suffix == 'out', 2, 1)
+    b_subsector = np.select(
+        [(b_sector == 4) & (b_station == 4), suffix == '+'],
+        [pd.Series(suffix).map({'--': 1, '-': 2, '+': 3, '++': 4}).fillna(1).to_numpy(np.int64), 2],
+        1)
+    b_roll = barrel['roll'].map({'Backward': 1, 'Middle': 2, 'Forward': 3})
+
+    # endcap, the segment is split back into sector and subsector
+    e_station = to_int(endcap['station'])
+    e_ring = to_int(endcap['ring'])
+    segment = to_int(endcap['segment'])
+    nsub = np.where((e_ring == 1) & (e_station > 1), 3, 6)
+    e_roll = endcap['roll'].map({'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5})
+
+    ids = {
+        'region': np.where(is_endcap, np.where(endcap['sign'] == '+', 1, -1), 0),
+        'ring': np.where(is_barrel, to_int(barrel['ring']), e_ring),
+        'station': np.where(is_barrel, b_station, e_station),
+        'sector': np.where(is_barrel, b_sector, (segment - 1) // nsub + 1),
+        'layer': np.where(is_barrel, b_layer, 1),
+        'subsector': np.where(is_barrel, b_subsector, (segment - 1) % nsub + 1),
+        'roll': np.where(is_barrel, to_int(b_roll), to_int(e_roll)),
+    }
+    unknown = ~(is_barrel | is_endcap)
+    return {key: np.where(unknown, 0, value).astype(np.int64)
+            for key, value in ids.items()}
+
+
+class RollTable:
+    """
+    roll lookup table; the roll index is the row index of the geometry
+    (e.g. data/geometry/run3.csv), which is also the bin index of the
+    roll axis of the flattened histograms.
+    corners (x, y, z) are (n_roll, 4) arrays and area is (n_roll, ), both
+    only available if the geometry has them
+    """
+
+    def __init__(self, roll_name: npt.NDArray[np.str_],
+                 x: Optional[npt.ArrayLike] = None,
+                 y: Optional[npt.ArrayLike] = None,
+                 z: Optional[npt.ArrayLike] = None,
+                 area: Optional[npt.ArrayLike] = None,
+                 **ids: npt.ArrayLike):
+        self.roll_name = np.asarray(roll_name, dtype=str)
+        for key in ID_KEYS:
+            setattr(self, key, np.asarray(ids[key], dtype=np.int64))
+        self.det_id = get_det_id(**{key: ids[key] for key in ID_KEYS})
+        self._sorter = np.argsort(self.det_id, kind='stable')
+        self._sorted_det_id = self.det_id[self._sorter]
+        self._name_sorter = np.argsort(self.roll_name, kind='stable')
+        self._sorted_roll_name = self.roll_name[self._name_sorter]
+        self.x, self.y, self.z, self.area = [
+            None if each is None else np.asarray(each, dtype=np.float64)
+            for each in (x, y, z, area)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.roll_name)
+
+    @classmethod
+    def from_geom(cls, geom: 'pd.DataFrame'):
+        """
+        ids are decoded from det_id if the geometry has no id columns
+        (e.g. data/geometry/run2.csv)
+        """
+        if all(key in geom.columns for key in ID_KEYS):
+            ids = {key: geom[key].to_numpy() for key in ID_KEYS}
+        else:
+            ids = decode_det_id(geom['det_id'].to_numpy())
+
+        corners = {}
+        for axis in ['x', 'y', 'z']:
+            columns = [f'{axis}{idx}' for idx in range(1, 5)]
+            if all(column in geom.columns for column in columns):
+                corners[axis] = geom[columns].to_numpy(np.float64)
+        if 'area' in geom.columns:
+            corners['area'] = geom['area'].to_numpy(np.float64)
+        return cls(geom['roll_name'].to_numpy(str), **corners, **ids)
+
+    @classmethod
+    def from_csv(cls, path):
+        import pandas as pd
+        return cls.from_geom(pd.read_csv(path))
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict[str, npt.NDArray]):
+        """
+        inverse of to_snapshot
+        """
+        columns = {key: snapshot[key] for key in ['x', 'y', 'z', 'area']
+                   if key in snapshot}
+        ids = {key: snapshot[key] for key in ID_KEYS}
+        roll_table = cls(snapshot['roll_name'], **columns, **ids)
+        if 'polygons' in snapshot:
+            roll_table.__dict__['polygons'] = snapshot['polygons']
+        return roll_table
+
+    def to_snapshot(self) -> dict[str, npt.NDArray]:
+        """
+        plain arrays of the table, e.g. for np.savez
+        """
+        snapshot = {'roll_name': self.roll_name, 'det_id': self.det_id}
+        snapshot.update({key: getattr(self, key) for key in ID_KEYS})
+        for key in ['x', 'y', 'z', 'area']:
+            if getattr(self, key) is not None:
+                snapshot[key] = getattr(self, key)
+        if self.x is not None and self.y is not None and self.z is not None:
+            snapshot['polygons'] = self.polygons
+        return snapshot
+
+    @classmethod
+    def load(cls, path, cache_dir: Optional[Path] = None):
+        """
+        from_csv through a binary snapshot, so that run2 and run3 csv files
+        give the same table and the csv is only parsed once. snapshots are
+        named after the hash of the csv content and cached under
+        cache_dir/geometry/v{GEOMETRY_SNAPSHOT_VERSION} (get_cache_dir() by
+        default); nothing is cached if it is not writable.
+        """
+        with open(path, 'rb') as stream:
+            content = stream.read()
+        cache_path = get_cache_path('geometry', content, GEOMETRY_SNAPSHOT_VERSION,
+                                    '.npz', cache_dir)
+        try:
+            with np.load(cache_path) as snapshot:
+                return cls.from_snapshot(dict(snapshot))
+        except (OSError, ValueError, KeyError):
+            pass
+
+        roll_table = cls.from_csv(path)
+        write_cache(cache_path,
+                    lambda stream: np.savez(stream, **roll_table.to_snapshot()))
+        return roll_table
+
+    @classmethod
+    def from_roll_name(cls, roll_name: npt.ArrayLike):
+        """
+        build the table from roll names, e.g. the roll axis of a flattened
+        file, when no geometry file is at hand
+        """
+        return cls(np.asarray(roll_name, dtype=str), **decode_roll_name(roll_name))
+
+    @classmethod
+    def from_ids(cls, region: npt.ArrayLike, ring: npt.ArrayLike,
+                 station: npt.ArrayLike, sector: npt.ArrayLike,
+                 layer: npt.ArrayLike, subsector: npt.ArrayLike,
+                 roll: npt.ArrayLike):
+        """
+        build the table from the rolls found in the id arrays when no geometry
+        file is at hand; names are decoded once per distinct roll
+        """
+        _, first = np.unique(
+            get_det_id(region, ring, station, sector, layer, subsector, roll),
+            return_index=True
+        )
+        ids = {key: np.asarray(value)[first]
+               for key, value in zip(ID_KEYS, (region, ring, station, sector,
+                                               layer, subsector, roll))}
+        roll_name = np.array([get_roll_name(*each)
+                              for each in zip(*[ids[key].tolist()
+                                                for key in ID_KEYS])],
+                             dtype=str)
+        return cls(roll_name, **ids)
+
+    @property
+    def barrel(self) -> npt.NDArray[np.bool_]:
+        return self.region == 0
+
+    @cached_property
+    def phi(self) -> npt.NDArray[np.float64]:
+        """
+        vectorized RPCRoll.phi of the four corners
+        """
+        assert self.x is not None and self.y is not None
+        phi = np.arctan2(self.y, self.x)
+        phi[phi < 0] += 2 * np.pi
+        # rolls across phi = 0 are drawn around 0 instead of 2 pi
+        wrapped = np.abs(phi[:, 0] - phi[:, 2]) > np.pi
+        phi[wrapped[:, np.newaxis] & (phi > np.pi)] -= 2 * np.pi
+        return phi
+
+    @cached_property
+    def detector_unit(self) -> npt.NDArray[np.str_]:
+        """
+        e.g. RB1in, RB4 or RE+1; decoded once per (region, station, layer)
+        """
+        keys = np.stack([self.region, self.station, self.layer], axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        names = np.array([get_detector_unit(*each) for each in unique.tolist()],
+                         dtype=str)
+        return names[inverse.reshape(-1)]
+
+    @cached_property
+    def hierarchy(self) -> 'RollHierarchy':
+        return RollHierarchy.from_roll_table(self)
+
+    @cached_property
+    def selector(self) -> 'RollSelector':
+        return RollSelector(self)
+
+    def select(self, expression: str) -> npt.NDArray[np.bool_]:
+        """
+        boolean mask over the rolls, see RollSelector
+        """
+        return self.selector(expression)
+
+    def get_unit_indices(self, mask: Optional[npt.NDArray[np.bool_]] = None
+    ) -> dict[str, npt.NDArray[np.int64]]:
+        """
+        roll indices of each detector unit in the order of the table
+        """
+        index = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        detector_unit = self.detector_unit[index]
+        _, first = np.unique(detector_unit, return_index=True)
+        return {detector_unit[each]: index[detector_unit == detector_unit[each]]
+                for each in np.sort(first)}
+
+    @cached_property
+    def polygons(self) -> npt.NDArray[np.float64]:
+        """
+        (n_roll, 4, 2) vertices of the rolls, (z, phi) in the barrel and
+        (x, y) in the endcap like RPCRoll.polygon
+        """
+        assert self.x is not None and self.y is not None and self.z is not None
+        barrel = self.barrel[:, np.newaxis]
+        u = np.where(barrel, self.z, self.x)
+        v = np.where(barrel, self.phi, self.y)
+        return np.stack([u, v], axis=2)
+
+    def get_polygons(self, index: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        return self.polygons[np.asarray(index)]
+
+    def get_roll_index(self, region: npt.ArrayLike, ring: npt.ArrayLike,
+                       station: npt.ArrayLike, sector: npt.ArrayLike,
+                       layer: npt.ArrayLike, subsector: npt.ArrayLike,
+                       roll: npt.ArrayLike
+    ) -> npt.NDArray[np.int64]:
+        """
+        roll index of each hit, -1 for rolls missing in the table
+        """
+        det_id = get_det_id(region, ring, station, sector, layer, subsector, roll)
+        if len(self) == 0:
+            return np.full(det_id.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_det_id, det_id)
+        pos = np.minimum(pos, len(self) - 1)
+        found = self._sorted_det_id[pos] == det_id
+        return np.where(found, self._sorter[pos], -1)
+
+    def get_roll_index_by_name(self, roll_name: npt.ArrayLike
+    ) -> npt.NDArray[np.int64]:
+        """
+        roll index of each name, -1 for names missing in the table
+        """
+        roll_name = np.asarray(roll_name, dtype=str)
+        if len(self) == 0:
+            return np.full(roll_name.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_roll_name, roll_name)
+        pos = np.minimum(pos, len(self) - 1)
+        found = self._sorted_roll_name[pos] == roll_name
+        return np.where(found, self._name_sorter[pos], -1)
+
+    def get_roll_name(self, index: npt.NDArray[np.int64]) -> npt.NDArray[np.str_]:
+        """
+        decode roll indices into names, '' for -1
+        """
+        index = np.asarray(index)
+        if len(self) == 0:
+            return np.full(index.shape, '', dtype=str)
+        return np.where(index >= 0, self.roll_name[index], '')
+
+
+HIERARCHY_LEVELS = ['chamber', 'sector', 'wheel_disk', 'station',
+                    'disk_group', 'region', 'all']
+
+
+class RollHierarchy:
+    """
+    integer group ids of the rolls of a RollTable at each level of
+    roll -> chamber -> sector -> wheel/disk -> region, so that any per-roll
+    array is summed per group with a single np.bincount.
+
+    chamber:    W-2_RB1in_S01, RE+1_R2_CH01
+    sector:     W-2_S01, RE+1_S01
+    wheel_disk: W-2, RE+1
+    station:    RB1, RE1 (both endcaps)
+    disk_group: Barrel, Disk1,2,3, Disk4
+    region:     Barrel, Endcap
+    all:        All
+    """
+
+    def __init__(self,
+                 group_id: dict[str, npt.NDArray[np.int64]],
+                 group_name: dict[str, npt.NDArray[np.str_]]):
+        self.group_id = group_id
+        self.group_name = group_name
+
+    @staticmethod
+    def _get_groups(keys: list[npt.NDArray[np.int64]],
+                    roll_name: npt.NDArray[np.str_],
+                    get_name,
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.str_]]:
+        """
+        group rolls by integer keys; get_name(first roll index) names a group
+        """
+        _, first, inverse = np.unique(np.stack(keys, axis=1), axis=0,
+                                      return_index=True, return_inverse=True)
+        names = np.array([get_name(each) for each in first.tolist()], dtype=str)
+        return inverse.reshape(-1).astype(np.int64), names
+
+    @classmethod
+    def from_roll_table(cls, roll_table: 'RollTable'):
+        region = roll_table.region
+        ring = roll_table.ring
+        station = roll_table.station
+        sector = roll_table.sector
+        name = roll_table.roll_name
+        barrel = region == 0
+        # wheel in the barrel, signed disk in the endcap
+        wheel_disk = np.where(barrel, ring, region * station)
+
+        def get_wheel_disk_name(index: int) -> str:
+            if barrel[index]:
+                return f'W{ring[index]:+d}'
+            return f'RE{wheel_disk[index]:+d}'
+
+        def get_station_name(index: int) -> str:
+            return f'{"RB" if barrel[index] else "RE"}{station[index]}'
+
+        def get_disk_group_name(index: int) -> str:
+            if barrel[index]:
+                return 'Barrel'
+            return 'Disk4' if station[index] == 4 else 'Disk1,2,3'
+
+        chamber_id = roll_table.det_id.astype(np.int64) & ~(0x7 << 15)
+        levels = {
+            'chamber': ([chamber_id],
+                        lambda index: name[index].rsplit('_', 1)[0]),
+            'sector': ([barrel, wheel_disk, sector],
+                       lambda index: f'{get_wheel_disk_name(index)}_S{sector[index]:0>2d}'),
+            'wheel_disk': ([barrel, wheel_disk], get_wheel_disk_name),
+            'station': ([barrel, station], get_station_name),
+            'disk_group': ([~barrel, ~barrel & (station == 4)], get_disk_group_name),
+            'region': ([~barrel], lambda index: 'Barrel' if barrel[index] else 'Endcap'),
+            'all': ([np.zeros(len(roll_table), dtype=np.int64)], lambda index: 'All'),
+        }
+        group_id = {}
+        group_name = {}
+        for level, (keys, get_name) in levels.items():
+            keys = [np.asarray(each, dtype=np.int64) for each in keys]
+            group_id[level], group_name[level] = cls._get_groups(keys, name, get_name)
+        return cls(group_id, group_name)
+
+    def get_n_group(self, level: str) -> int:
+        return len(self.group_name[level])
+
+    def find(self, name: str) -> Optional[tuple[str, int]]:
+        """
+        (level, group index) of a group name such as 'Disk4' or 'W+1'
+        """
+        for level in HIERARCHY_LEVELS:
+            index = np.flatnonzero(self.group_name[level] == name)
+            if len(index) > 0:
+                return level, int(index[0])
+        return None
+
+    def get_mask(self, name: str) -> npt.NDArray[np.bool_]:
+        """
+        rolls of a group
+        """
+        found = self.find(name)
+        if found is None:
+            raise KeyError(f'unknown group {name}')
+        level, index = found
+        return self.group_id[level] == index
+
+    def sum(self, values: npt.ArrayLike, level: str) -> npt.NDArray[np.float64]:
+        """
+        sum a (n_roll, ) or (n_roll, n) array over the rolls of each group
+        """
+        values = np.asarray(values, dtype=np.float64)
+        group_id = self.group_id[level]
+        n_group = self.get_n_group(level)
+        if values.ndim == 1:
+            return np.bincount(group_id, weights=values, minlength=n_group)
+        n_column = values.shape[1]
+        index = (group_id[:, np.newaxis] * n_column + np.arange(n_column)).ravel()
+        return np.bincount(index, weights=values.ravel(),
+                           minlength=n_group * n_column).reshape(n_group, n_column)
+
+
+SELECTION_TOKEN = re.compile(r'\s*(?:(<=|>=|==|!=|<|>)|([&|!()])|([\w+\-,:.]+))')
+
+# aliases of group names used by the plotting scripts
+SELECTION_ALIASES = {'disk123': 'disk1,2,3'}
+
+# names a full geometry has: fixed groups, then wheels, disks, stations,
+# detector units, sectors, chambers and rolls by their name prefix
+DETECTOR_NAME = re.compile(r'all|barrel|endcap|disk1,2,3|disk4|(W[+-]\d|RB\d|RE[+-]?\d)\w*',
+                           re.IGNORECASE)
+
+
+class AbsentSelectionError(ValueError):
+    """
+    a region or roll name of the detector without any roll in the table,
+    e.g. RE+4 in a table built from hits once RE4 was excluded
+    """
+
+
+class RollSelector:
+    """
+    compile region expressions into boolean masks over the rolls of a
+    RollTable; masks are cached by expression string.
+
+    expression := term (('&' | '|') term)*, '&' binds tighter than '|'
+    term       := '!' term | '(' expression ')' | field op int | name
+    field      := region, ring, station, sector, layer, subsector, roll,
+                  wheel (barrel only), disk (signed, endcap only)
+    name       := a named mask added with add(), e.g. blacklist:2023, then a
+                  hierarchy group or detector unit (case-insensitive, e.g.
+                  All, Barrel, Disk1,2,3, W-2, RE+4, RB1in), otherwise a
+                  prefix of the roll name (e.g. RE+4_R1_CH15); a name
+                  matching none of them raises AbsentSelectionError if it
+                  is a name of the detector missing from the table and
+                  ValueError otherwise, e.g. a typo or a mask that was
+                  never added
+
+    e.g. 'barrel & station<=2 & !blacklist:2023' after
+    selector.add('blacklist:2023', roll_blacklist)
+    """
+
+    def __init__(self, roll_table: RollTable):
+        self.roll_table = roll_table
+        self.named: dict[str, npt.NDArray[np.bool_]] = {}
+        self._cache: dict[str, npt.NDArray[np.bool_]] = {}
+
+    @cached_property
+    def _groups(self) -> dict[str, tuple[npt.NDArray[np.int64], int]]:
+        """
+        lowercase group name to (group id of each roll, group index)
+        """
+        rt = self.roll_table
+        groups = {}
+        # lower levels win like RollHierarchy.find
+        for level in reversed(HIERARCHY_LEVELS):
+            for index, name in enumerate(rt.hierarchy.group_name[level]):
+                groups[name.lower()] = (rt.hierarchy.group_id[level], index)
+        unit, unit_id = np.unique(rt.detector_unit, return_inverse=True)
+        for index, name in enumerate(unit):
+            groups.setdefault(name.lower(), (unit_id.reshape(-1), index))
+        return groups
+
+    @cached_property
+    def _fields(self) -> dict[str, npt.NDArray[np.int64]]:
+        rt = self.roll_table
+        fields = {key: getattr(rt, key) for key in ID_KEYS}
+        # out of range for the other region so that comparisons fail there
+        invalid = np.iinfo(np.int64).min
+        fields['wheel'] = np.where(rt.barrel, rt.ring, invalid)
+        fields['disk'] = np.where(rt.barrel, invalid, rt.region * rt.station)
+        return fields
+
+    def add(self, name: str, rolls: npt.ArrayLike) -> 'RollSelector':
+        """
+        name a boolean mask or a list of roll names (e.g. a roll blacklist)
+        """
+        rolls = np.asarray(rolls)
+        if rolls.dtype != bool:
+            index = self.roll_table.get_roll_index_by_name(rolls.astype(str))
+            rolls = np.zeros(len(self.roll_table), dtype=bool)
+            rolls[index[index >= 0]] = True
+        self.named[name] = rolls
+        self._cache.clear()
+        return self
+
+    def __call__(self, expression: str) -> npt.NDArray[np.bool_]:
+        if expression not in self._cache:
+            mask = self._compile(expression)
+            mask.flags.writeable = False
+            self._cache[expression] = mask
+        return self._cache[expression]
+
+    @staticmethod
+    def _tokenize(expression: str) -> list[str]:
+        tokens = []
+        pos = 0
+        expression = expression.strip()
+        while pos < len(expression):
+            match = SELECTION_TOKEN.match(expression, pos)
+            if match is None or match.end() == pos:
+                raise ValueError(f'invalid selection {expression!r} at {pos}')
+            tokens.append(match.group(match.lastindex))
+            pos = match.end()
+        return tokens
+
+    def _compile(self, expression: str) -> npt.NDArray[np.bool_]:
+        tokens = self._tokenize(expression)
+        pos = 0
+
+        def peek() -> Optional[str]:
+            return tokens[pos] if pos < len(tokens) else None
+
+        def take() -> str:
+            nonlocal pos
+            if pos >= len(tokens):
+                raise ValueError(f'unexpected end of selection {expression!r}')
+            pos += 1
+            return tokens[pos - 1]
+
+        def parse_or() -> npt.NDArray[np.bool_]:
+            mask = parse_and()
+            while peek() == '|':
+                take()
+                mask = mask | parse_and()
+            return mask
+
+        def parse_and() -> npt.NDArray[np.bool_]:
+            mask = parse_term()
+            while peek() == '&':
+                take()
+                mask = mask & parse_term()
+            return mask
+
+        def parse_term() -> npt.NDArray[np.bool_]:
+            token = take()
+            if token == '!':
+                return ~parse_term()
+            if token == '(':
+                mask = parse_or()
+                if take() != ')':
+                    raise ValueError(f'unbalanced parentheses in {expression!r}')
+                return mask
+            if peek() in ('<=', '>=', '==', '!=', '<', '>'):
+                return self._compare(token, take(), take())
+            return self._lookup(token)
+
+        mask = parse_or()
+        if peek() is not None:
+            raise ValueError(f'unexpected {peek()!r} in selection {expression!r}')
+        return mask
+
+    def _compare(self, field: str, op: str, value: str) -> npt.NDArray[np.bool_]:
+        if field not in self._fields:
+            raise KeyError(f'unknown field {field}')
+        values = self._fields[field]
+        value = int(value)
+        return {'<=': values <= value, '>=': values >= value,
+                '==': values == value, '!=': values != value,
+                '<': values < value, '>': values > value}[op]
+
+    def _lookup(self, name: str) -> npt.NDArray[np.bool_]:
+        if name in self.named:
+            return self.named[name]
+        key = name.lower()
+        key = SELECTION_ALIASES.get(key, key)
+        if key in self._groups:
+            group_id, index = self._groups[key]
+            return group_id == index
+        mask = np.char.startswith(self.roll_table.roll_name, name)
+        if not mask.any() and DETECTOR_NAME.fullmatch(key):
+            raise AbsentSelectionError(f'no roll of {name!r} in the table')
+        if not mask.any():
+            raise ValueError(f'unknown name {name!r} in selection, neither an '
+                             f'added mask, a group nor a roll name prefix')
+        return mask
+
+
+# tables decoded from roll names keyed by the names, so that their
+# RollSelector and its compiled selections are shared; oldest go first
+_roll_name_tables: dict[tuple[str, ...], RollTable] = {}
+ROLL_NAME_TABLE_CACHE_SIZE = 8
+
+def get_roll_name_table(roll_name: npt.ArrayLike) -> RollTable:
+    """
+    RollTable.from_roll_name cached on the names, e.g. for the roll axis of
+    every count read from the same campaign
+    """
+    roll_name = np.asarray(roll_name, dtype=str)
+    key = tuple(roll_name.tolist())
+    if key not in _roll_name_tables:
+        _roll_name_tables[key] = RollTable.from_roll_name(roll_name)
+        while len(_roll_name_tables) > ROLL_NAME_TABLE_CACHE_SIZE:
+            _roll_name_tables.pop(next(iter(_roll_name_tables)))
+    return _roll_name_tables[key]
+
+def select_roll_names(roll_name: npt.ArrayLike, expression: str,
+                      roll_table: Optional[RollTable] = None,
+) -> npt.NDArray[np.bool_]:
+    """
+    RollSelector mask of each roll name, e.g. of hits; names missing in the
+    table are not selected. the table is built from the distinct names if
+    none is given, once per set of names
+    """
+    name, inverse = np.unique(np.asarray(roll_name, dtype=str), return_inverse=True)
+    if roll_table is None:
+        roll_table = get_roll_name_table(name)
+    index = roll_table.get_roll_index_by_name(name)
+    mask = np.append(roll_table.select(expression), False)[index]
+    return mask[inverse.reshape(-1)]
+
+
+@dataclass
+class GeometryDiff:
+    """
+    rolls of two geometries matched by det_id; moved rolls have a corner
+    displaced by more than the tolerance [cm] and resized rolls an area
+    changed by more than the tolerance [cm^2]
+    """
+    added: npt.NDArray[np.str_]
+    removed: npt.NDArray[np.str_]
+    # (old name, new name) of rolls with the same det_id
+    renamed: list[tuple[str, str]]
+    moved: npt.NDArray[np.str_]
+    # largest corner displacement [cm] of each moved roll
+    shift: npt.NDArray[np.float64]
+    resized: npt.NDArray[np.str_]
+    # new over old area of each resized roll
+    area_ratio: npt.NDArray[np.float64]
+
+    def __bool__(self) -> bool:
+        return bool(len(self.added) or len(self.removed) or len(self.renamed)
+                    or len(self.moved) or len(self.resized))
+
+
+def diff_geometry(old: RollTable, new: RollTable, tolerance: float = 0.01
+) -> GeometryDiff:
+    """
+    e.g. diff_geometry(RollTable.load('run2.csv'), RollTable.load('run3.csv'))
+    """
+    _, old_index, new_index = np.intersect1d(old.det_id, new.det_id,
+                                             assume_unique=True,
+                                             return_indices=True)
+    added = ~np.isin(new.det_id, old.det_id)
+    removed = ~np.isin(old.det_id, new.det_id)
+
+    old_name = old.roll_name[old_index]
+    new_name = new.roll_name[new_index]
+    renamed = old_name != new_name
+
+    shift = np.zeros(len(old_index))
+    if all(getattr(each, axis) is not None for each in (old, new) for axis in 'xyz'):
+        displacement = np.sqrt(sum(
+            (getattr(new, axis)[new_index] - getattr(old, axis)[old_index]) ** 2
+            for axis in 'xyz'))
+        shift = displacement.max(axis=1)
+    moved = shift > tolerance
+
+    area_ratio = np.ones(len(old_index))
+    resized = np.zeros(len(old_index), dtype=bool)
+    if old.area is not None and new.area is not None:
+        old_area, new_area = old.area[old_index], new.area[new_index]
+        resized = np.abs(new_area - old_area) > tolerance
+        area_ratio = np.divide(new_area, old_area, out=np.full_like(new_area, np.nan),
+                               where=old_area != 0)
+
+    return GeometryDiff(
+        added=new.roll_name[added],
+        removed=old.roll_name[removed],
+        renamed=list(zip(old_name[renamed].tolist(), new_name[renamed].tolist())),
+        moved=new_name[moved],
+        shift=shift[moved],
+        resized=new_name[resized],
+        area_ratio=area_ratio[resized],
+    )
+
+
 @dataclass(frozen=True, unsafe_hash=True)
 class RPCDetId:
     region: int
@@ -100,7 +852,7 @@ class RPCRoll:
     z: npt.NDArray[np.float64]
 
     @classmethod
-    def from_row(cls, row: pd.Series):
+    def from_row(cls, row: 'pd.Series'):
         x = row[[f'x{idx}' for idx in range(1, 5)]].to_numpy(np.float64)
         y = row[[f'y{idx}' for idx in range(1, 5)]].to_numpy(np.float64)
         z = row[[f'z{idx}' for idx in range(1, 5)]].to_numpy(np.float64)
@@ -116,34 +868,26 @@ class RPCRoll:
         return phi
 
     @property
-    def polygon(self) -> Polygon:
+    def polygon(self) -> 'Polygon':
+        from NanoAODTnP.RPCGeometry.RPCGeomPlot import make_polygon
         # if barrel
         if self.id.barrel:
             xy = np.stack([self.z, self.phi], axis=1)
         else:
             xy = np.stack([self.x, self.y], axis=1)
-        return Polygon(xy, closed=True)
+        return make_polygon(xy)
 
     @property
     def polygon_xlabel(self) -> str:
-        if self.id.barrel:
-            xlabel = r'$z$ [cm]'
-        else:
-            xlabel = r'$x$ [cm]'
-        return xlabel
+        from NanoAODTnP.RPCGeometry.RPCGeomPlot import get_polygon_labels
+        return get_polygon_labels(self.id.barrel)[0]
 
     @property
     def polygon_ylabel(self) -> str:
-        if self.id.barrel:
-            ylabel = r'$\phi$ [radian]'
-        else:
-            ylabel = r'$y$ [cm]'
-        return ylabel
+        from NanoAODTnP.RPCGeometry.RPCGeomPlot import get_polygon_labels
+        return get_polygon_labels(self.id.barrel)[1]
 
     @property
     def polygon_ymax(self):
-        if self.id.barrel:
-            ymax = 7
-        else:
-            ymax = None
-        return ymax
+        from NanoAODTnP.RPCGeometry.RPCGeomPlot import get_polygon_labels
+        return get_polygon_labels(self.id.barrel)[2]
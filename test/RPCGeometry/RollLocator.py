@@ -0,0 +1,199 @@
+import numpy as np
+import numpy.typing as npt
+
+from NanoAODTnP.RPCGeometry.RPCGeomServ import RollTable
+
+
+class RollLocator:
+    """
+    point to roll lookup with a uniform grid per detector unit; the grid is
+    in (z, phi) for barrel stations and in (x, y) for endcap disks.
+
+    candidates of a grid cell are tested in the plane of each roll, where
+    every roll is a convex quad, so distances are in cm:
+    - barrel: e1 = z, e2 = along the roll width, normal = radial
+    - endcap: e1 = x, e2 = y, normal = z
+    """
+
+    def __init__(self, roll_table: RollTable, cells_per_roll: float = 4.0,
+                 max_offset: float = 10.0, batch_size: int = 1 << 18):
+        assert roll_table.x is not None
+        assert roll_table.y is not None
+        assert roll_table.z is not None
+        self.roll_table = roll_table
+        # points farther than this [cm] from the plane of a roll are outside
+        self.max_offset = max_offset
+        self.batch_size = batch_size
+        self._build_frames()
+        self.grids = {unit: self._build_grid(index, cells_per_roll)
+                      for unit, index in roll_table.get_unit_indices().items()}
+
+    def _build_frames(self):
+        """
+        edge and plane equations of every roll in its local frame
+        (e1, e2, normal)
+        """
+        rt = self.roll_table
+        corners = np.stack([rt.x, rt.y, rt.z], axis=2) # (n_roll, 4, 3)
+        n_roll = len(rt)
+        barrel = rt.barrel
+
+        # barrel rolls are flat and parallel to the beam; corners 1 and 2
+        # share z, so they give the direction along the roll width
+        chord = corners[:, 1, :2] - corners[:, 0, :2]
+        chord_norm = np.linalg.norm(chord, axis=1, keepdims=True)
+        chord = np.divide(chord, chord_norm, out=np.zeros_like(chord),
+                          where=chord_norm > 0)
+
+        e1 = np.zeros((n_roll, 3))
+        e2 = np.zeros((n_roll, 3))
+        normal = np.zeros((n_roll, 3))
+        e1[barrel, 2] = 1
+        e2[barrel, :2] = chord[barrel]
+        normal[barrel, 0] = -chord[barrel, 1]
+        normal[barrel, 1] = chord[barrel, 0]
+        e1[~barrel, 0] = 1
+        e2[~barrel, 1] = 1
+        normal[~barrel, 2] = 1
+
+        center = corners.mean(axis=1)
+        local = corners - center[:, np.newaxis, :]
+        local = np.stack([np.einsum('rck,rk->rc', local, e1),
+                          np.einsum('rck,rk->rc', local, e2)], axis=2)
+        # counterclockwise corners, so that inside means left of every edge
+        u, v = local[..., 0], local[..., 1]
+        area = np.sum(u * np.roll(v, -1, axis=1) - np.roll(u, -1, axis=1) * v,
+                      axis=1)
+        local[area < 0] = local[area < 0, ::-1]
+        edge = np.roll(local, -1, axis=1) - local
+        edge_norm = np.linalg.norm(edge, axis=2, keepdims=True)
+        edge = np.divide(edge, edge_norm, out=np.zeros_like(edge),
+                         where=edge_norm > 0)
+
+        # the signed distance to each edge, (edge x (q - corner)) in the
+        # roll plane, and the offset from the plane are linear in the global
+        # point q, i.e. coef . q + const with 4 edges and the normal
+        coef = (edge[..., 0, np.newaxis] * e2[:, np.newaxis, :]
+                - edge[..., 1, np.newaxis] * e1[:, np.newaxis, :])
+        const = -np.einsum('rec,rc->re', coef, center) \
+            - (edge[..., 0] * local[..., 1] - edge[..., 1] * local[..., 0])
+        coef = np.concatenate([coef, normal[:, np.newaxis, :]], axis=1)
+        const = np.concatenate([const, -np.einsum('rc,rc->r', normal, center)[:, np.newaxis]],
+                               axis=1)
+        self.coef_x, self.coef_y, self.coef_z = coef[..., 0], coef[..., 1], coef[..., 2]
+        self.const = const
+
+    def _get_grid_coordinates(self, barrel: bool, x, y, z):
+        if barrel:
+            phi = np.arctan2(y, x)
+            return z, np.where(phi < 0, phi + 2 * np.pi, phi)
+        return x, y
+
+    def _build_grid(self, index: npt.NDArray[np.int64], cells_per_roll: float):
+        rt = self.roll_table
+        barrel = bool(rt.barrel[index[0]])
+        u, v = self._get_grid_coordinates(barrel, rt.x[index], rt.y[index],
+                                          rt.z[index])
+        boxes = [(u.min(axis=1), u.max(axis=1), v.min(axis=1), v.max(axis=1))]
+        roll_index = [index]
+        if barrel:
+            # rolls across phi = 0 are registered at both ends of the axis
+            wrapped = (v.max(axis=1) - v.min(axis=1)) > np.pi
+            v_low = np.where(v > np.pi, -np.inf, v).max(axis=1)
+            v_high = np.where(v < np.pi, np.inf, v).min(axis=1)
+            boxes = [(u.min(axis=1), u.max(axis=1),
+                      np.where(wrapped, v_high, v.min(axis=1)),
+                      np.where(wrapped, 2 * np.pi, v.max(axis=1))),
+                     (u.min(axis=1)[wrapped], u.max(axis=1)[wrapped],
+                      np.zeros(wrapped.sum()), v_low[wrapped])]
+            roll_index = [index, index[wrapped]]
+
+        u_min, u_max = u.min(), u.max()
+        v_min, v_max = (0, 2 * np.pi) if barrel else (v.min(), v.max())
+        n_cell = max(int(np.sqrt(cells_per_roll * len(index))), 1)
+        n_u = n_v = n_cell
+        du = (u_max - u_min) / n_u or 1.0
+        dv = (v_max - v_min) / n_v or 1.0
+
+        cells = [[] for _ in range(n_u * n_v)]
+        for (u_lo, u_hi, v_lo, v_hi), rolls in zip(boxes, roll_index):
+            iu_lo = np.clip(((u_lo - u_min) // du).astype(int), 0, n_u - 1)
+            iu_hi = np.clip(((u_hi - u_min) // du).astype(int), 0, n_u - 1)
+            iv_lo = np.clip(((v_lo - v_min) // dv).astype(int), 0, n_v - 1)
+            iv_hi = np.clip(((v_hi - v_min) // dv).astype(int), 0, n_v - 1)
+            for roll, a, b, c, d in zip(rolls.tolist(), iu_lo, iu_hi, iv_lo, iv_hi):
+                for iu in range(a, b + 1):
+                    for iv in range(c, d + 1):
+                        cells[iu * n_v + iv].append(roll)
+
+        # candidates of cell c are rolls[ptr[c]:ptr[c + 1]], without padding
+        # to the fullest cell
+        ptr = np.zeros(n_u * n_v + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum([len(each) for each in cells])
+        rolls = np.array([roll for each in cells for roll in each], dtype=np.int64)
+        return dict(barrel=barrel, u_min=u_min, v_min=v_min, du=du, dv=dv,
+                    n_u=n_u, n_v=n_v, ptr=ptr, rolls=rolls)
+
+    def _locate_batch(self, grid: dict, x, y, z):
+        u, v = self._get_grid_coordinates(grid['barrel'], x, y, z)
+        iu = np.floor((u - grid['u_min']) / grid['du']).astype(np.int64)
+        iv = np.floor((v - grid['v_min']) / grid['dv']).astype(np.int64)
+        in_grid = (iu >= 0) & (iu < grid['n_u']) & (iv >= 0) & (iv < grid['n_v'])
+        cell = np.where(in_grid, iu * grid['n_v'] + iv, 0)
+        first = grid['ptr'][cell]
+        n_candidate = np.where(in_grid, grid['ptr'][cell + 1] - first, 0)
+
+        # one (point, candidate) pair per candidate of the cell of a point,
+        # grouped by point in the order of the cell
+        n_point = len(x)
+        point = np.repeat(np.arange(n_point), n_candidate)
+        start = np.cumsum(n_candidate) - n_candidate
+        roll = grid['rolls'][first[point] + np.arange(len(point)) - start[point]]
+        value = (self.coef_x[roll] * x[point, np.newaxis]
+                 + self.coef_y[roll] * y[point, np.newaxis]
+                 + self.coef_z[roll] * z[point, np.newaxis] + self.const[roll])
+        distance = value[:, :4].min(axis=1)
+        offset = np.abs(value[:, 4])
+        inside = (distance >= 0) & (offset <= self.max_offset)
+
+        roll_index = np.full(n_point, -1, dtype=np.int64)
+        edge_distance = np.full(n_point, np.nan)
+        has_candidate = n_candidate > 0
+        if not has_candidate.any():
+            return roll_index, edge_distance
+        group = start[has_candidate]
+        # the closest plane wins among overlapping rolls, the first one on
+        # ties; points inside no roll get the largest edge distance
+        best_offset = np.minimum.reduceat(np.where(inside, offset, np.inf), group)
+        is_best = inside & (offset == np.repeat(best_offset, n_candidate[has_candidate]))
+        pair = np.arange(len(point))
+        best = np.minimum.reduceat(np.where(is_best, pair, len(point)), group)
+        found = best < len(point)
+        closest = np.maximum.reduceat(distance, group)
+
+        index = np.flatnonzero(has_candidate)
+        roll_index[index[found]] = roll[best[found]]
+        edge_distance[index] = np.where(found, distance[np.minimum(best, len(point) - 1)],
+                                        closest)
+        return roll_index, edge_distance
+
+    def locate(self, detector_unit: str, x: npt.ArrayLike, y: npt.ArrayLike,
+               z: npt.ArrayLike,
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+        """
+        roll index (-1 if outside every roll) of global points on a detector
+        unit (e.g. RB1in or RE+1) and their distance [cm] to the nearest edge
+        of that roll; other points get the distance to the closest roll of
+        their grid cell, which is negative unless the point is more than
+        max_offset away from its plane, or nan if the cell is empty
+        """
+        x, y, z = [np.asarray(each, dtype=np.float64).reshape(-1)
+                   for each in (x, y, z)]
+        grid = self.grids[detector_unit]
+        roll_index = np.empty(len(x), dtype=np.int64)
+        edge_distance = np.empty(len(x), dtype=np.float64)
+        for start in range(0, len(x), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            roll_index[batch], edge_distance[batch] = self._locate_batch(
+                grid, x[batch], y[batch], z[batch])
+        return roll_index, edge_distance